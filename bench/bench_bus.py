@@ -0,0 +1,227 @@
+"""
+Event bus micro-benchmarks.
+
+Runs on plain CPython, no hardware required. Results are printed as a table and
+optionally written as json. Compare against a saved baseline to catch regressions:
+
+    python bench/bench_bus.py --json baseline.json
+    # ... change code ...
+    python bench/bench_bus.py --baseline baseline.json --tolerance 0.2
+
+Exits with status 1 if any benchmark is slower than the baseline by more than tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "leaf", "remote"))
+
+from eventbus import Bridge, Device, Event, State, Transport, bus  # noqa: E402
+from eventbus.ev_bus import Bus  # noqa: E402
+
+BENCHMARKS = {}  # name -> async function(n) returning number of operations performed
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def sync_handler(**event):
+    pass
+
+
+async def async_handler(**event):
+    pass
+
+
+STATE = {"topic": "!state", "uid": "bench.dev.voltage", "value": 12.8, "timestamp": 0, "dst": "#clients"}
+
+
+def emit_benchmark(handler, handlers):
+    async def run(n):
+        b = Bus()
+        for _ in range(handlers):
+            b.subscribe(handler, "!state")
+        for _ in range(n):
+            await b.emit(STATE)
+        return n
+
+    return run
+
+
+def emit_event_benchmark(handlers):
+    """Event objects delivered to as_event handlers."""
+
+    def handler(event):
+        pass
+
+    async def run(n):
+        b = Bus()
+        for _ in range(handlers):
+            b.subscribe(handler, "!state", as_event=True)
+        event = Event.from_dict(STATE)
+        for _ in range(n):
+            await b.emit(event)
+        return n
+
+    return run
+
+
+for _handlers in (1, 10, 100):
+    benchmark(f"emit/sync/{_handlers}")(emit_benchmark(sync_handler, _handlers))
+    benchmark(f"emit/async/{_handlers}")(emit_benchmark(async_handler, _handlers))
+    benchmark(f"emit/as_event/{_handlers}")(emit_event_benchmark(_handlers))
+
+
+@benchmark("emit_sync/drain")
+async def emit_sync_drain(n):
+    b = Bus(sync_queue_size=n)
+    done = asyncio.Event()
+    count = 0
+
+    def handler(**event):
+        nonlocal count
+        count += 1
+        if count == n:
+            done.set()
+
+    b.subscribe(handler, "!log")
+    for i in range(n):
+        b.emit_sync(topic="!log", message="bench", seq=i)
+    await done.wait()
+    return n
+
+
+@benchmark("device/update")
+async def device_update(n):
+    bus.LEAF_ID = "bench"
+    device = Device("bench_device", State("voltage"))
+    bus.subscribe(sync_handler, "!state")
+    try:
+        for i in range(n):
+            await device.update("voltage", i)
+    finally:
+        bus.unsubscribe(sync_handler, "!state")
+    return n
+
+
+class MemoryTransport(Transport):
+    def __init__(self):
+        self.bytes = 0
+
+    async def send(self, message):
+        self.bytes += len(message)
+
+
+@benchmark("bridge/emit_flush")
+async def bridge_emit_flush(n):
+    """Serialize events into batches of 100 and flush them to an in-memory transport."""
+    bridge = Bridge("bench_peer", MemoryTransport())
+    try:
+        for i in range(n):
+            await bridge.emit(STATE)
+            if i % 100 == 99:
+                await bridge.flush()
+        await bridge.flush()
+    finally:
+        await bridge.close()
+        bridge._detach()
+    return n
+
+
+@benchmark("bridge/route/100")
+async def bridge_route(n):
+    """Events addressed to one of 100 connected bridges."""
+    bridges = [Bridge(f"peer{i}", MemoryTransport()) for i in range(100)]
+    try:
+        event = dict(STATE, dst="peer0")
+        for _ in range(n):
+            await bus.emit(event)
+    finally:
+        for bridge in bridges:
+            await bridge.close()
+            bridge._detach()
+    return n
+
+
+async def measure(func, n: int, repeat: int) -> float:
+    """Best of repeat runs [operations / second]."""
+    best = 0.0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        ops = await func(n)
+        best = max(best, ops / (time.perf_counter() - t0))
+    return best
+
+
+async def run(names, n: int, repeat: int) -> dict:
+    results = {}
+    for name in names:
+        results[name] = {"ops_per_sec": await measure(BENCHMARKS[name], n, repeat), "n": n}
+    return {
+        "python": sys.version.split()[0],
+        "implementation": sys.implementation.name,
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Names of benchmarks slower than baseline by more than tolerance."""
+    regressions = []
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is not None and result["ops_per_sec"] < (1 - tolerance) * base["ops_per_sec"]:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", default="", help="only run benchmarks whose name contains this string")
+    parser.add_argument("-n", type=int, default=10_000, help="operations per run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the best is reported")
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    parser.add_argument("--baseline", help="compare against results saved with --json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown relative to baseline")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.k in name]
+    report = asyncio.run(run(names, args.n, args.repeat))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    for name, result in report["results"].items():
+        line = f"{name:24} {result['ops_per_sec']:14,.0f} ops/s"
+        base = baseline and baseline["results"].get(name)
+        if base:
+            line += f" {result['ops_per_sec'] / base['ops_per_sec']:8.2f}x baseline"
+        print(line, file=sys.stderr if args.json == "-" else sys.stdout)
+
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"REGRESSION: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
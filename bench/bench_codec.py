@@ -0,0 +1,145 @@
+"""
+Bridge wire codecs: encode / decode throughput and frame size, JSON lines vs MessagePack,
+with and without interning and deflate compression.
+
+Usage:
+    python bench/bench_codec.py
+
+Frames hold 100 events, as encoded by Bridge.emit and decoded by Bridge.run. The
+events are synthetic but varied like real traffic: !state updates of many uids on
+several leaves with drifting values and advancing timestamps, device descriptions
+and log messages. Each configuration encodes (and decodes) one connection's stream
+of frames in order; sizes exclude the first frame (symbol definitions and the
+compression context persist across the frames of a connection).
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "leaf", "remote"))
+
+from eventbus.event_net.codec import COMPRESSIONS, JSON, MSGPACK, FrameDecoder, FrameEncoder, SymbolTable  # noqa: E402
+
+LEAVES = [f"leaf{i}" for i in range(1, 5)]
+SENSORS = ["victron.battery_voltage", "victron.battery_current", "victron.soc", "ina.current", "bme.temperature"]
+ROOMS = ["kitchen", "bedroom", "garage", "porch", "office"]
+LEVELS = [("DEBUG", 10), ("INFO", 20), ("INFO", 20), ("WARNING", 30), ("ERROR", 40)]
+
+FRAME = 100  # events per frame
+FRAMES = 200
+
+
+def state_events(rng: random.Random, n: int) -> list:
+    uids = [(leaf, f"{leaf}.{sensor}") for leaf in LEAVES for sensor in SENSORS]
+    values = {uid: rng.uniform(0, 100) for _, uid in uids}
+    t = 1718000000.0
+    events = []
+    for _ in range(n):
+        leaf, uid = rng.choice(uids)
+        values[uid] += rng.gauss(0, 0.2)
+        t += rng.expovariate(50)
+        events.append(
+            {
+                "topic": "!state",
+                "uid": uid,
+                "value": round(values[uid], 2),
+                "timestamp": round(t, 3),
+                "dst": "#clients",
+                "src": leaf,
+            }
+        )
+    return events
+
+
+def device_events(rng: random.Random, n: int) -> list:
+    events = []
+    for _ in range(n):
+        leaf = rng.choice(LEAVES)
+        uid = f"{leaf}.{rng.choice(ROOMS)}_light{rng.randrange(4)}"
+        events.append(
+            {
+                "topic": "!device",
+                "uid": uid,
+                "domain": "light",
+                "attributes": {"name": uid.split(".")[1].replace("_", " ").title()},
+                "entities": {
+                    f"{uid}.state": {"kind": "Transducer", "attributes": {}},
+                    f"{uid}.brightness": {
+                        "kind": "Transducer",
+                        "attributes": {"unit": "%", "max": rng.randrange(100, 256)},
+                    },
+                },
+                "dst": "#server",
+                "src": leaf,
+            }
+        )
+    return events
+
+
+def log_events(rng: random.Random, n: int) -> list:
+    t = 1718000000.0
+    events = []
+    for _ in range(n):
+        leaf = rng.choice(LEAVES)
+        levelname, levelno = rng.choice(LEVELS)
+        t += rng.expovariate(5)
+        message = rng.choice(
+            [
+                f"Starting leaf {leaf}",
+                f"Connected to {rng.choice(LEAVES)} in {rng.uniform(0, 2):.3f}s",
+                f"{rng.choice(SENSORS)}: read failed ({rng.randrange(1, 6)} retries)",
+                f"Free memory: {rng.randrange(20000, 90000)} bytes",
+            ]
+        )
+        events.append(
+            {
+                "topic": "!log",
+                "levelname": levelname,
+                "levelno": levelno,
+                "name": rng.choice(["app", "bridge", "devices", "victron"]),
+                "message": message,
+                "timestamp": round(t, 3),
+                "src": leaf,
+            }
+        )
+    return events
+
+
+TRAFFIC = {"!state": state_events, "!device": device_events, "!log": log_events}
+
+
+def timed(func, *args):
+    """Result of func(*args) and the time it took [s]."""
+    t0 = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - t0
+
+
+def encode(encoder: FrameEncoder, batches: list) -> list:
+    return [encoder.frame([encoder.event(event) for event in batch]) for batch in batches]
+
+
+def decode(decoder: FrameDecoder, frames: list):
+    for frame in frames:
+        decoder.decode(frame)
+
+
+def main():
+    print(f"{'event':8} {'codec':24} {'bytes/event':>11} {'encode [ev/s]':>14} {'decode [ev/s]':>14}")
+    for name, traffic in TRAFFIC.items():
+        events = traffic(random.Random(1), FRAMES * FRAME)
+        batches = [events[i : i + FRAME] for i in range(0, len(events), FRAME)]
+        for codec in (JSON, MSGPACK):
+            for compression, intern in [(c, i) for i in (False, True) for c in (None,) + COMPRESSIONS]:
+                encoder = FrameEncoder(codec, compression, SymbolTable() if intern else None)
+                frames, t_enc = timed(encode, encoder, batches)
+                _, t_dec = timed(decode, FrameDecoder(), frames)
+                size = sum(len(f.encode() if isinstance(f, str) else f) for f in frames[1:]) / (len(events) - FRAME)
+                label = codec + ("+intern" if intern else "") + (f"+{compression}" if compression else "")
+                print(f"{name:8} {label:24} {size:11.1f} {len(events) / t_enc:14,.0f} {len(events) / t_dec:14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
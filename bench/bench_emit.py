@@ -0,0 +1,87 @@
+"""
+Bus.emit throughput before and after precompiled dispatch plans.
+
+Usage:
+    python bench/bench_emit.py
+
+`LegacyBus` reproduces the original dispatch (listener lookups and an
+`isinstance(res, Awaitable)` check per handler on every emit).
+"""
+
+import asyncio
+import os
+import sys
+import time
+from typing import Awaitable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "leaf", "remote"))
+
+from eventbus.ev_bus import ALL_HANDLER, NO_HANDLER, Bus  # noqa: E402
+
+EVENTS = 20_000
+
+
+class LegacyBus(Bus):
+    """Bus.emit as it was before dispatch plans."""
+
+    def subscribe(self, cb, *topics):
+        for topic in topics:
+            if topic not in self.listeners:
+                self.listeners[topic] = []
+            self.listeners[topic].append(cb)
+
+    async def emit(self, event: dict | None = None, **kwargs):
+        if event is None:
+            event = kwargs
+        else:
+            event.update(kwargs)
+        if "src" not in event:
+            event["src"] = self.LEAF_ID
+        topic = event.get("topic")
+        if topic in self.listeners:
+            await self._legacy_call(self.listeners[topic], event)  # type: ignore
+        else:
+            await self._legacy_call(self.listeners.get(NO_HANDLER, []), event)
+        await self._legacy_call(self.listeners.get(ALL_HANDLER, []), event)
+
+    async def _legacy_call(self, funcs, event):
+        for func in funcs:
+            try:
+                res = func(**event)
+                if isinstance(res, Awaitable):
+                    await res
+            except TypeError as e:
+                print("***** ERROR", event, e)
+
+
+def sync_handler(topic, **event):
+    pass
+
+
+async def async_handler(topic, **event):
+    pass
+
+
+async def throughput(bus: Bus, handlers: int, handler) -> float:
+    """Events per second for `handlers` subscribers of !state."""
+    for _ in range(handlers):
+        bus.subscribe(handler, "!state")
+    event = {"topic": "!state", "uid": "leaf1.dev.voltage", "value": 12.8, "timestamp": 0, "dst": "#clients"}
+    t0 = time.perf_counter()
+    for _ in range(EVENTS):
+        await bus.emit(event)
+    return EVENTS / (time.perf_counter() - t0)
+
+
+async def main():
+    print(f"{'handler':8} {'n':>4} {'before [ev/s]':>14} {'after [ev/s]':>14} {'speedup':>8}")
+    for handler in (sync_handler, async_handler):
+        kind = "async" if handler is async_handler else "sync"
+        for n in (1, 10, 100):
+            before = await throughput(LegacyBus(), n, handler)
+            after = await throughput(Bus(), n, handler)
+            print(f"{kind:8} {n:4} {before:14,.0f} {after:14,.0f} {after / before:8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+"""
+Replay recorded bus traffic (see plugins/core/recorder.py) against a local bus.
+
+    python bench/replay.py recording.jsonl.1 recording.jsonl --speed 10 \
+        --plugin plugins.core.sensor_state --plugin plugins.core.log
+
+Plugins are imported and their `init()` called before the replay. Prints the
+achieved throughput and the handler latencies as json.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "leaf", "remote"))
+
+from plugins.core.recorder import replay  # noqa: E402
+
+
+async def run(args):
+    for module in args.plugin:
+        m = __import__(module, None, None, ("init",), 0)
+        if hasattr(m, "init"):
+            res = m.init()
+            if asyncio.iscoroutine(res):
+                await res
+    return await replay(*args.recordings, speed=args.speed or None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", help="recording files, oldest first")
+    parser.add_argument("--speed", type=float, default=0, help="1: original timing, 10: 10x faster, 0: max speed")
+    parser.add_argument("--plugin", action="append", default=[], help="plugin module to load, e.g. plugins.core.log")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    rate = report["events_per_sec"]
+    print(f"{report['events']} events in {report['seconds']:.3f}s: {rate:,.0f} events/s", file=sys.stderr)
+    json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import os
 from datetime import datetime
 from typing import Any
 
-from eventbus import bus
+from eventbus import bus, correlate
 from util import WithCD, is_micropython
 
 logger = logging.getLogger(__name__)
@@ -19,14 +19,14 @@ class Config:
         self._config = self._load()
 
         @bus.on("?config")
-        async def on_config_get(topic, src, dst, path=None, default=None):
+        async def on_config_get(topic, src, dst, path=None, default=None, rid=None):
             """Get config values."""
-            await bus.emit(topic="!config", dst=src, config=self.get(path, default))
+            await bus.emit(topic="!config", dst=src, config=self.get(path, default), **correlate(rid))
 
         @bus.on("?config-version")
-        async def on_config_version_get(topic, src, dst):
+        async def on_config_version_get(topic, src, dst, rid=None):
             """Get config version."""
-            await bus.emit(topic="!config-version", dst=src, config=self.get("version"))
+            await bus.emit(topic="!config-version", dst=src, config=self.get("version"), **correlate(rid))
 
     def get(self, path=None, default=None) -> Any:
         """Get configuration value.
@@ -6,13 +6,18 @@
 global:
     bus: Bus
     Note: set bus.LEAF_ID before use!
+
+Additional, isolated leaves (e.g. for simulations) get their own bus from `create_bus`.
 """
 
-from .ev_bus import Bus
+from .ev_bus import Bus, correlate
+from .event import Event
+from .metrics import Metrics
 
 bus = Bus()
 
 from .devices import Actuator, Device, State, Transducer, make_uid
+from .devices import attach as _attach_devices
 from .devices.binary_sensor import BinarySensor
 from .devices.light import Light
 from .devices.sensor import Sensor
@@ -20,10 +25,44 @@ from .devices.switch import Switch
 from .event_net import Bridge, Transport
 
 
-@bus.on("?echo")
-async def echo(topic, src, dst, data=None):
-    """All leaves respond to ?echo events."""
-    global bus
-    if src == bus.LEAF_ID:
-        return
-    await bus.emit(topic="!echo", dst=src, data=data)
+def serve(bus: Bus):
+    """Subscribe the responders all leaves provide (?echo, ?metrics) on bus."""
+
+    @bus.on("?echo")
+    async def echo(topic, src, dst, data=None, rid=None):
+        """All leaves respond to ?echo events."""
+        if src == bus.LEAF_ID:
+            return
+        await bus.emit(topic="!echo", dst=src, data=data, **correlate(rid))
+
+    @bus.on("?metrics")
+    async def metrics_responder(topic, src, dst=None, reset=False, rid=None):
+        """Report bus metrics. Enable recording with `bus.metrics = Metrics()`."""
+        if dst not in (None, bus.LEAF_ID):
+            return
+        report = None if bus.metrics is None else bus.metrics.report(bus)
+        await bus.emit(topic="!metrics", dst=src, metrics=report, **correlate(rid))
+        if reset and bus.metrics is not None:
+            bus.metrics.reset()
+
+    return echo, metrics_responder
+
+
+def create_bus(leaf_id: str, **kwargs) -> Bus:
+    """
+    Bus for an additional leaf in this process, isolated from `bus`.
+
+    Has the standard responders and its own device registry. Pass it to the
+    devices (`Device(..., bus=)`) and bridges (`Bridge(..., bus=)`) of the leaf.
+
+    Args:
+        leaf_id (str): Address of the leaf.
+        **kwargs: Bus options.
+    """
+    b = Bus(leaf_id=leaf_id, **kwargs)
+    serve(b)
+    _attach_devices(b)
+    return b
+
+
+echo, metrics_responder = serve(bus)
@@ -0,0 +1,112 @@
+import asyncio
+import heapq
+import time
+
+# MicroPython ports with epoch 2000
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+
+
+class Clock:
+    """
+    Wall clock time and timers used by the bus, bridges and devices.
+
+    Replace with a VirtualClock (e.g. `bus.clock = VirtualClock()`) to run tests
+    and simulations in virtual time.
+    """
+
+    # asyncio timers, used as is to avoid overhead
+    sleep = staticmethod(asyncio.sleep)
+    wait_for = staticmethod(asyncio.wait_for)
+
+    @staticmethod
+    def time() -> float:
+        """Seconds since 1970-01-01 UTC."""
+        return time.time() + EPOCH_OFFSET
+
+
+class VirtualClock(Clock):
+    """
+    Clock that only advances when told to.
+
+    `sleep` and `wait_for` wait for virtual time; `advance` moves time forward and
+    fires the timers due, in deadline order, letting woken tasks run after each.
+    Hours of simulated traffic thus run as fast as the handlers allow, and runs
+    are repeatable.
+
+    Example:
+        clock = VirtualClock()
+        bus = Bus(clock=clock)
+        ...
+        await clock.advance(3600)  # one hour later
+    """
+
+    def __init__(self, start: float = 0, settle: int = 3):
+        """
+        Args:
+            start (float): Initial time [s since epoch].
+            settle (int): Loop iterations given to woken tasks after each timer.
+        """
+        self.now = start
+        self.settle = settle
+        self._timers = []  # heap of [deadline, seq, callback]; callback None when cancelled
+        self._seq = 0
+
+    def time(self) -> float:
+        return self.now
+
+    def _timer(self, delay: float, callback) -> list:
+        self._seq += 1
+        timer = [self.now + delay, self._seq, callback]
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    async def sleep(self, seconds: float):
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        flag = asyncio.Event()
+        timer = self._timer(seconds, flag.set)
+        try:
+            await flag.wait()
+        finally:
+            timer[2] = None
+
+    async def wait_for(self, aw, timeout: float | None):
+        if timeout is None:
+            return await aw
+        task = asyncio.ensure_future(aw)  # coroutines and futures, like asyncio.wait_for
+        expired = []
+
+        def expire():
+            expired.append(True)
+            task.cancel()
+
+        timer = self._timer(timeout, expire)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if expired:
+                raise asyncio.TimeoutError()
+            task.cancel()
+            raise
+        finally:
+            timer[2] = None
+
+    async def advance(self, seconds: float):
+        """Move time forward by seconds, firing the timers that fall due."""
+        # let tasks that are ready start their timers first
+        await self._settle()
+        target = self.now + seconds
+        timers = self._timers
+        while timers and timers[0][0] <= target:
+            deadline, _, callback = heapq.heappop(timers)
+            if callback is None:
+                continue
+            self.now = deadline
+            callback()
+            await self._settle()
+        self.now = target
+
+    async def _settle(self):
+        for _ in range(self.settle):
+            await asyncio.sleep(0)
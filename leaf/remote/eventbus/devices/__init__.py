@@ -1,14 +1,11 @@
-import time
+from .. import bus, correlate
+from ..clock import EPOCH_OFFSET  # noqa: F401
 
-from .. import bus
+_default_bus = bus
 
 # separation characters in uid's
 UID_SEP = "."
 
-
-# MicroPython time starts from 2000-01-01 on some ports
-EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
-
 # MicroPython does not support this
 # from typing import Awaitable, Callable, TypeAlias
 # ActionCallback: TypeAlias = Callable[..., Awaitable[None] | None]
@@ -22,9 +19,9 @@ def camel_to_snake(s):
     return "".join(["_" + c.lower() if c.isupper() else c for c in s]).lstrip("_")
 
 
-def make_uid(device_id: str, entity_id: str, node_id=bus.LEAF_ID) -> str:
-    """Construct entity uid."""
-    return f"{node_id}{UID_SEP}{device_id}{UID_SEP}{entity_id}"
+def make_uid(device_id: str, entity_id: str, node_id=None) -> str:
+    """Construct entity uid. node_id defaults to bus.LEAF_ID."""
+    return f"{bus.LEAF_ID if node_id is None else node_id}{UID_SEP}{device_id}{UID_SEP}{entity_id}"
 
 
 """
@@ -38,7 +35,8 @@ Client communication is via events:
 * `!device` - device information
 
 The `Device` class implements a registry of devices and their entities (states and actuators). It can 
-also be used by actual hardware to send out and respond to these events.
+also be used by actual hardware to send out and respond to these events. Each bus has its own registry
+(`Bus.devices`), so one process can host several (e.g. simulated) leaves.
 
 Derived classes such as `binary_sensor`, `switch`, `light` provide customized solutions.
 """
@@ -60,13 +58,13 @@ def Transducer(id, callback: ActionCallback, **attributes):
 
 
 class Device:
-    _registry = {}  # uid -> device
-    _callbacks = {}  # uid -> callback
+    _registry = {}  # uid -> device, registry of the default bus
 
     def __init__(
         self,
         device_id: str,
         *entities,
+        bus=None,
         **attributes,
     ):
         """
@@ -75,6 +73,7 @@ class Device:
         Args:
             device_id (str): The identifier for the device.
             *entities: sensor states, actuators, and transducers.
+            bus (Bus): Bus of the leaf hosting the device. Default: eventbus.bus.
             **attributes: Keyword arguments representing attributes of the device.
 
         Raises:
@@ -91,9 +90,12 @@ class Device:
 
         """
         assert device_id.isidentifier(), f"Invalid device_id: {device_id}"
+        self.bus = _default_bus if bus is None else bus
         self.device_id = device_id
         self.attributes = attributes
         self.entities = {}  # uid -> (kind, callback, attributes)
+        self._callbacks = {}  # uid -> callback
+        self._registry = attach(self.bus)
         self._registry[self.uid()] = self
         for entity_id, kind, callback, attributes in entities:
             assert entity_id.isidentifier(), f"Invalid id: {entity_id}"
@@ -101,7 +103,7 @@ class Device:
             self.entities[entity_uid] = (kind, callback, attributes)
             if callback is not None:
                 self._callbacks[entity_uid] = callback
-        bus.emit_sync(
+        self.bus.emit_sync(
             topic="!device",
             uid=self.uid(),
             domain=self.domain,
@@ -136,26 +138,27 @@ class Device:
             >>> device.uid('entity_id')
             'leaf_id.device_id.entity_id'
         """
+        leaf_id = self.bus.LEAF_ID
         return (
-            f"{bus.LEAF_ID}{UID_SEP}{self.device_id}"
+            f"{leaf_id}{UID_SEP}{self.device_id}"
             if entity_id is None
-            else f"{bus.LEAF_ID}{UID_SEP}{self.device_id}{UID_SEP}{entity_id}"
+            else f"{leaf_id}{UID_SEP}{self.device_id}{UID_SEP}{entity_id}"
         )
 
-    async def update(self, entity_id, value, timestamp: float = time.time() + EPOCH_OFFSET):
+    async def update(self, entity_id, value, timestamp: float | None = None):
         """Helper to emit a state update events.
 
         Args:
             entity_id (str): entity_id or uid of the state.
             value: The new value to set for the entity.
-            timestamp (float, optional): The timestamp of the update event. Defaults to the current time.
+            timestamp (float, optional): The timestamp of the update event. Defaults to the current time (bus.clock).
 
         """
-        await bus.emit(
+        await self.bus.emit(
             topic="!state",
             uid=entity_id if "." in entity_id else self.uid(entity_id=entity_id),
             value=value,
-            timestamp=timestamp,
+            timestamp=self.bus.clock.time() if timestamp is None else timestamp,
             dst="#clients",
         )
 
@@ -164,29 +167,46 @@ class Device:
         return f"{self.__class__.__name__}({self.device_id}, {e}, {self.attributes})"
 
 
-@bus.on("?device")
-async def device_info(src, **rest):
-    """Send info for all registered devices"""
-    for uid, device in Device._registry.items():
-        await bus.emit(
-            topic="!device",
-            uid=uid,
-            domain=device.domain,
-            attributes=device.attributes,
-            entities=device.info,
-            dst=src,
-        )
-
-
-@bus.on("?act")
-async def act(topic, uid, **event):
-    """Call callback for entity"""
-    device_uid, _ = uid.rsplit(UID_SEP, 1)
-    device = Device._registry.get(device_uid)
-    if device is None:
-        return
-    _, callback, _ = device.entities.get(uid) or (None, None, None)
-    if callback is not None:
-        event.pop("src", None)
-        event.pop("dst", None)
-        await callback(device, uid, **event)
+def attach(bus) -> dict:
+    """
+    Device registry of bus, created on first use.
+
+    Creating the registry subscribes the ?device and ?act responders for the
+    devices registered with bus.
+    """
+    if bus.devices is not None:
+        return bus.devices
+    registry = bus.devices = Device._registry if bus is _default_bus else {}
+
+    @bus.on("?device")
+    async def device_info(src, rid=None, **rest):
+        """Send info for all registered devices"""
+        for uid, device in registry.items():
+            await bus.emit(
+                topic="!device",
+                uid=uid,
+                domain=device.domain,
+                attributes=device.attributes,
+                entities=device.info,
+                dst=src,
+                **correlate(rid),
+            )
+
+    @bus.on("?act")
+    async def act(topic, uid, **event):
+        """Call callback for entity"""
+        device_uid, _ = uid.rsplit(UID_SEP, 1)
+        device = registry.get(device_uid)
+        if device is None:
+            return
+        _, callback, _ = device.entities.get(uid) or (None, None, None)
+        if callback is not None:
+            event.pop("src", None)
+            event.pop("dst", None)
+            event.pop("rid", None)
+            await callback(device, uid, **event)
+
+    return registry
+
+
+attach(bus)
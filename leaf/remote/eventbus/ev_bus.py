@@ -1,9 +1,23 @@
 import asyncio
-import functools
 from typing import Awaitable
 
+from .clock import Clock
+from .event import Event
+from .event_queue import BLOCK, DROP_NEWEST, DROP_OLDEST, EventQueue, LaneQueue
+from .metrics import Metrics, handler_name, ticks_diff, ticks_us
+from .workers import KeyedWorkers, in_executor
+
+try:
+    from inspect import iscoroutinefunction
+except ImportError:
+    # MicroPython: handlers are classified as sync and their result is checked instead
+    def iscoroutinefunction(func):
+        return False
+
+
 ALL_HANDLER = "*"
 NO_HANDLER = "!"
+WILDCARD = "*"  # trailing wildcard in topic patterns, e.g. '?*' or '!state/leaf1/*'
 
 # MicroPython does not support this
 # from typing import Awaitable, Callable, TypeAlias
@@ -13,6 +27,108 @@ async def Callback(*args):
     pass
 
 
+class Subscription:
+    """
+    Handle returned by `Bus.subscribe`.
+
+    `cancel()` removes the subscription in O(1). Can be used as a context manager:
+
+        with bus.subscribe(cb, "!state"):
+            ...
+    """
+
+    def __init__(self, bus, cb: Callback, topics: tuple, as_event: bool, timeout: float | None = None):
+        self.bus = bus
+        self.cb = cb
+        self.topics = topics
+        self.as_event = as_event
+        self.timeout = timeout
+        self.handler = cb  # called by the bus, cb or a wrapper (e.g. executor)
+        self.pool: KeyedWorkers | None = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.topics)
+
+    def cancel(self):
+        """Unsubscribe from all topics. Safe to call more than once."""
+        self.bus._remove(self, self.topics)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cancel()
+
+
+class Stream:
+    """
+    Async iterator over the events of some topics, returned by `Bus.stream`.
+
+    Events are buffered in an EventQueue, so a slow consumer does not stall emit
+    (unless the overflow policy is BLOCK). `close()` unsubscribes; iteration ends
+    once the buffered events are consumed.
+
+    Attributes:
+        subscription (Subscription): The subscription feeding the stream.
+        queue (EventQueue): The buffer.
+    """
+
+    def __init__(self, bus, topics: tuple, maxsize: int, policy: str, coalesce):
+        self.queue = EventQueue(maxsize, policy, coalesce)
+        self._batch = []
+        self._index = 0
+        put = self.queue.put if policy == BLOCK else self.queue.put_nowait
+        self.subscription = bus.subscribe(put, *topics, as_event=True)
+
+    @property
+    def dropped(self) -> int:
+        """Number of events discarded due to overflow."""
+        return self.queue.dropped
+
+    def close(self):
+        """Stop receiving events. Safe to call more than once."""
+        self.subscription.cancel()
+        self.queue.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._index >= len(self._batch):
+            self._batch = await self.queue.get_batch()
+            self._index = 0
+            if not self._batch:
+                raise StopAsyncIteration
+        event = self._batch[self._index]
+        self._index += 1
+        return event
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def correlate(rid) -> dict:
+    """
+    Arguments tagging a response with the correlation id of its query (see Bus.request).
+
+    Example:
+        await bus.emit(topic="!echo", dst=src, data=data, **correlate(rid))
+    """
+    return {} if rid is None else {"rid": rid}
+
+
+class _Waiter:
+    """Bus.listen waiting for an event."""
+
+    def __init__(self):
+        self.flag = asyncio.Event()
+        self.event = None
+
+
 class Bus:
     """
     A class that represents an event emitter.
@@ -20,60 +136,226 @@ class Bus:
     The EventEmitter class allows registering event handlers for specific topics and emitting events to those handlers.
 
     Attributes:
-        LEAF_ID (str): Address of this leaf.
+        LEAF_ID (str): Address of this leaf. Set per instance to host several leaves in one process.
+        clock (Clock): Time source and timers of the bus and its bridges and devices.
+        metrics (Metrics): Instrumentation, None if disabled. Reported in response to ?metrics.
     """
 
     LEAF_ID: str | None = None
 
-    def __init__(self, *, sync_queue_size=20, pause=0.1):
+    def __init__(
+        self,
+        *,
+        sync_queue_size=20,
+        pause=0,
+        overflow=DROP_NEWEST,
+        thread_overflow=BLOCK,
+        coalesce=(),
+        lanes: dict | None = None,
+        lane_quota=10,
+        concurrency: int | None = None,
+        handler_timeout: float | None = None,
+        breaker_threshold: int | None = None,
+        breaker_reset: float = 30,
+        executor_workers: int | None = None,
+        metrics=False,
+        clock: Clock | None = None,
+        leaf_id: str | None = None,
+    ):
         """
         Initializes the event emitter object.
 
         Args:
             sync_queue_size (int): The maximum size of the emit_sync queue.
-            pause (float): Delay between submission of sync events.
+            pause (float): Delay between batches of sync events.
+            overflow (str): emit_sync queue overflow policy, DROP_NEWEST, DROP_OLDEST or BLOCK (see event_queue).
+            thread_overflow (str): emit_threadsafe overflow policy. Default BLOCK: the calling thread
+                waits for room rather than dropping events.
+            coalesce: Topics whose queued emit_sync events are coalesced by (topic, uid), e.g. ("!state",).
+            lanes (dict): Priority lanes of the emit_sync queue, topic -> lane, e.g. {"?act": HIGH}.
+                Other topics go to the last (lowest priority) lane. See event_queue.LaneQueue.
+                Only events posted with emit_sync (e.g. from interrupt handlers) are queued
+                there; control events from peers are prioritised by the Bridge (`Bridge.urgent`).
+            lane_quota (int): Maximum number of lowest priority events delivered per batch.
+            concurrency (int): If set, run up to this many async handlers of an event concurrently.
+                Default: call handlers one after another.
+            handler_timeout (float): Time budget of handlers [s], default: unlimited. Async handlers
+                are cancelled when they exceed it, sync handlers (which cannot be interrupted) are
+                counted as failed. Override per subscription with `subscribe(..., timeout=)`.
+            breaker_threshold (int): Stop calling a handler after this many consecutive failures
+                (exceptions or timeouts), default: never.
+            breaker_reset (float): Seconds until a handler stopped by the breaker is tried again.
+            executor_workers (int): Size of the thread and process pools of `subscribe(..., executor=)`.
+            metrics (bool): Record per-topic and per-handler metrics (see `metrics`).
+            clock (Clock): Time and timers, e.g. a clock.VirtualClock for tests and simulations.
+            leaf_id (str): Address of the leaf, sets LEAF_ID.
 
         """
-        self.listeners: dict[str, list[Callback]] = {}  # topic -> [callbacks]
-        self.event_queue = None
+        self.listeners: dict[str, dict[Subscription, None]] = {}  # topic -> {subscriptions} (ordered)
+        self._subscriptions: dict[Callback, dict[Subscription, None]] = {}  # callback -> {subscriptions}
+        self._waiters: dict[str, list[_Waiter]] = {}  # topic -> Bus.listen waiters
+        self._requests: dict[str, _Waiter] = {}  # rid -> Bus.request waiter
+        self._rid = 0
+        self._plans: dict[str, tuple] = {}  # topic -> ((callback, is_async, as_event), ...)
+        self._trie: dict = {}  # char -> subtrie; key "" holds the pattern ending at this node
+        self._routes: dict[str, list[Callback]] = {}  # dst -> [sinks], e.g. bridges
+        self.event_queue: EventQueue | LaneQueue | None = None
+        self._inbox = None  # ThreadInbox for emit_threadsafe
         self.sync_queue_size = sync_queue_size
         self.pause = pause
+        self.overflow = overflow
+        self.thread_overflow = thread_overflow
+        self.coalesce = coalesce
+        self.lanes = lanes
+        self.lane_quota = lane_quota
+        self.concurrency = concurrency
+        self.handler_timeout = handler_timeout
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self._failures: dict[Callback, int] = {}  # handler -> consecutive failures
+        self._open: dict[Callback, float] = {}  # handler -> time until which the breaker skips it
+        self.executor_workers = executor_workers
+        self._executors = {}  # "thread" | "process" -> concurrent.futures executor
+        self.metrics: Metrics | None = Metrics() if metrics else None
+        self.clock = Clock() if clock is None else clock
+        self.devices: dict | None = None  # uid -> Device, see devices.attach
+        if leaf_id is not None:
+            self.LEAF_ID = leaf_id
+
+    def subscribe(
+        self,
+        cb: Callback,
+        *topics,
+        as_event=False,
+        timeout: float | None = None,
+        workers: int | None = None,
+        key: str = "uid",
+        executor=None,
+    ) -> Subscription:
+        """
+        Subscribe callback to one or more topics.
+
+        Callbacks are called with the event as keyword arguments, or, if as_event is True,
+        with the event object (an Event or dict, as emitted) as the only argument.
+
+        timeout overrides the bus handler_timeout for this subscription.
+
+        With workers=N, events are handed to a pool of N worker tasks instead of being
+        handled during emit. Events are sharded by event[key]: events with the same key
+        are handled in order, different keys concurrently (see workers.KeyedWorkers).
 
-    def subscribe(self, cb: Callback, *topics):
-        """Subscribe callback to one or more topics."""
+        With executor="thread" or "process" (or a concurrent.futures.Executor), the callback
+        runs in a pool managed by the bus and the loop stays responsive while it computes.
+        emit waits for the result; a returned dict is emitted as an event. CPython only.
+
+        Returns:
+            Subscription handle, call `cancel()` to unsubscribe.
+        """
+        sub = Subscription(self, cb, topics, as_event, timeout)
+        if executor is not None:
+            assert not isinstance(executor, str) or executor in ("thread", "process"), f"Invalid executor: {executor}"
+            sub.handler = in_executor(self, cb, executor)
+        if workers:
+            sub.pool = KeyedWorkers(self, sub.handler, key, workers, as_event, timeout)
         for topic in topics:
             if topic not in self.listeners:
-                self.listeners[topic] = []
-            self.listeners[topic].append(cb)
+                self.listeners[topic] = {}
+                if self._is_pattern(topic):
+                    self._insert_pattern(topic)
+            self.listeners[topic][sub] = None
+        if cb not in self._subscriptions:
+            self._subscriptions[cb] = {}
+        self._subscriptions[cb][sub] = None
+        self._plans = {}
+        return sub
 
     def unsubscribe(self, cb: Callback, *topics):
         """Unsubscribe callback to one or more topics. If no topics are provided, remove cb from all topics."""
+        for sub in list(self._subscriptions.get(cb, ())):
+            self._remove(sub, topics or sub.topics)
+
+    def _remove(self, sub: Subscription, topics):
+        """Remove subscription from topics."""
         for topic in topics:
-            if topics:
-                if topic in self.listeners:
-                    self.listeners[topic].remove(cb)
-            else:
-                for listeners in self.listeners.values():
-                    if cb in listeners:
-                        listeners.remove(cb)
+            if topic in sub.topics:
+                subs = self.listeners[topic]
+                subs.pop(sub, None)
+                if not subs:
+                    # topics without subscribers are dropped, e.g. so '!' applies again
+                    del self.listeners[topic]
+                    if self._is_pattern(topic):
+                        self._remove_pattern(topic)
+        sub.topics = tuple(t for t in sub.topics if t not in topics)
+        if not sub.topics:
+            if sub.pool is not None:
+                sub.pool.close()
+            subs = self._subscriptions.get(sub.cb)
+            if subs is not None:
+                subs.pop(sub, None)
+                if not subs:
+                    del self._subscriptions[sub.cb]
+        self._plans = {}
+
+    def add_route(self, dst: str, sink: Callback):
+        """
+        Deliver events addressed to dst (e.g. a peer or group such as '#clients') to sink.
+
+        Sinks are async callables that receive the event object. They are called after
+        the handlers, and only for events whose dst matches, so the cost of routing does
+        not grow with the number of sinks (e.g. connected bridges).
+        """
+        if dst not in self._routes:
+            self._routes[dst] = []
+        self._routes[dst].append(sink)
+
+    def remove_route(self, dst: str, sink: Callback):
+        """Remove sink from the route for dst."""
+        sinks = self._routes.get(dst)
+        if sinks and sink in sinks:
+            sinks.remove(sink)
+            if not sinks:
+                del self._routes[dst]
 
     def unsubscribe_all(self):
         """Remove all callbacks."""
+        for subs in self._subscriptions.values():
+            for sub in subs:
+                sub.topics = ()
+                if sub.pool is not None:
+                    sub.pool.close()
         self.listeners = {}
-
-    def on(self, *topics):
+        self._subscriptions = {}
+        self._plans = {}
+        self._trie = {}
+
+    def on(
+        self,
+        *topics,
+        as_event=False,
+        timeout: float | None = None,
+        workers: int | None = None,
+        key: str = "uid",
+        executor=None,
+    ):
         """
         Decorator function to register a handler for one or more topics.
 
         Args:
             *topics: Variable number of topics to listen to.
+            as_event (bool): Pass the event object rather than keyword arguments to the handler.
+            timeout (float): Time budget of the handler [s], see `subscribe`.
+            workers (int), key (str): Handle events in a pool of workers, sharded by key, see `subscribe`.
+            executor (str): Run the handler in a "thread" or "process" pool, see `subscribe`.
 
             The following topics have special meaning:
             - '*': A handler that listens to all topics.
             - '!': A handler that listens to topics that have no registered handlers.
+            - Topics ending in '*' are prefix patterns, e.g. '?*' matches all queries
+              and '!state/leaf1/*' matches '!state/leaf1/voltage'.
 
         Returns:
-            A decorator function that wraps the provided function and adds it to the event map.
+            A decorator that subscribes the function and returns it unchanged (so that, e.g.,
+            it can still be pickled for executor="process").
 
         Example:
             @event_emitter.on('topic1', 'topic2')
@@ -82,39 +364,99 @@ class Bus:
         """
 
         def decorator_on(func):
-            self.subscribe(func, *topics)
+            self.subscribe(
+                func, *topics, as_event=as_event, timeout=timeout, workers=workers, key=key, executor=executor
+            )
+            return func
 
-            @functools.wraps(func)
-            def wrapper_on(event):
-                return func(event)
+        return decorator_on
 
-            return wrapper_on
+    def stream(self, *topics, maxsize: int = 100, policy: str = DROP_OLDEST, coalesce=()) -> Stream:
+        """
+        Continuous feed of events on one or more topics (patterns allowed).
 
-        return decorator_on
+        Args:
+            *topics: Topics to receive.
+            maxsize (int): Maximum number of buffered events.
+            policy (str): Overflow policy, DROP_OLDEST (default), DROP_NEWEST or
+                BLOCK (emit waits for the consumer).
+            coalesce: Topics to coalesce by (topic, uid) while buffered, e.g. ("!state",).
+
+        Returns:
+            Stream, an async iterator of events (as emitted). Close it when done.
+
+        Example:
+            with bus.stream("!state", "!log") as events:
+                async for event in events:
+                    print(event)
+        """
+        return Stream(self, topics, maxsize, policy, coalesce)
 
     async def listen(self, topic: str):
         """Wait for a single event on the given topic."""
-        flag = asyncio.Event()
-        event = None
+        # waiters are resolved by emit, no subscription needed
+        waiter = _Waiter()
+        if topic not in self._waiters:
+            self._waiters[topic] = []
+            self._plans.pop(topic, None)  # waiters count as handlers (no '!')
+        self._waiters[topic].append(waiter)
+        try:
+            await waiter.flag.wait()
+        finally:
+            waiters = self._waiters.get(topic)
+            if waiters and waiter in waiters:
+                # cancelled
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[topic]
+                    self._plans.pop(topic, None)
+        return waiter.event
+
+    async def request(self, topic: str, *, dst: str | None = None, timeout: float | None = 5, **kwargs):
+        """
+        Send a query and wait for the response.
 
-        async def cb(**_event):
-            nonlocal event, flag
-            flag.set()
-            event = _event
+        The query is tagged with a correlation id, `rid`. Responders copy `rid` into
+        their response, which resolves the request no matter which topic it is sent on
+        (e.g. '!state' or the error '#state'). Concurrent requests, including requests
+        to and from peers connected with a Bridge, never receive each other's responses.
+        If the query is answered with several events, the first one is returned.
 
-        self.subscribe(cb, topic)
-        await flag.wait()
-        self.unsubscribe(cb, topic)
-        return event
+        Args:
+            topic (str): Query topic, e.g. '?config'.
+            dst (str): Address of the responder. Default: any.
+            timeout (float): Seconds to wait for the response, None to wait forever.
+            **kwargs: Arguments of the query.
+
+        Returns:
+            The response event.
+
+        Raises:
+            asyncio.TimeoutError: No response within timeout.
 
-    async def emit(self, event: dict | None = None, **kwargs):
+        Example:
+            event = await bus.request("?config", dst="leaf1", path="version")
+            print(event["config"])
+        """
+        self._rid += 1
+        rid = f"{self.LEAF_ID}:{self._rid}"
+        waiter = self._requests[rid] = _Waiter()
+        try:
+            await self.emit(kwargs, topic=topic, dst=dst, rid=rid)
+            if waiter.event is None:
+                await self.clock.wait_for(waiter.flag.wait(), timeout)
+        finally:
+            self._requests.pop(rid, None)
+        return waiter.event
+
+    async def emit(self, event: dict | Event | None = None, **kwargs):
         """
         Emits an event to all registered event handlers for the given topic.
-        Event may be specified as a dict or kwargs or both (in which kwargs
+        Event may be specified as a dict (or Event) or kwargs or both (in which kwargs
         take precedence and are merged into event).
 
         Args:
-            event (dict)
+            event (dict | Event)
             **kwargs: Arguments to pass to the event handler. Merged into event.
         """
         if event is None:
@@ -124,59 +466,346 @@ class Bus:
         if "src" not in event:
             event["src"] = self.LEAF_ID
         topic = event.get("topic")
-        if topic in self.listeners:
-            # call registered handlers for the topic
-            await self._call_handler(self.listeners[topic], event)  # type: ignore
+        plan = self._plans.get(topic)  # type: ignore
+        if plan is None:
+            plan = self._build_plan(topic)  # type: ignore
+        if self.metrics is not None:
+            t0 = ticks_us()
+            if self.concurrency:
+                await self._call_handler_concurrent(plan, event)
+            else:
+                await self._call_handler_timed(plan, event)
+            self.metrics.record_dispatch(topic, ticks_diff(ticks_us(), t0))
+        elif self.concurrency:
+            await self._call_handler_concurrent(plan, event)
         else:
-            # no registered handlers for the topic - call catch-all handler
-            await self._call_handler(self.listeners.get(NO_HANDLER, []), event)
-        # call registered handlers for all topics
-        await self._call_handler(self.listeners.get(ALL_HANDLER, []), event)
+            await self._call_handler(plan, event)
+        if self._requests:
+            rid = event.get("rid")
+            if rid in self._requests and not topic.startswith("?"):  # type: ignore
+                # response to Bus.request (the query carries the same rid)
+                waiter = self._requests.pop(rid)
+                waiter.event = event
+                waiter.flag.set()
+        if self._waiters and topic in self._waiters:
+            self._plans.pop(topic, None)
+            for waiter in self._waiters.pop(topic):  # type: ignore
+                waiter.event = event
+                waiter.flag.set()
+        if self._routes:
+            sinks = self._routes.get(event.get("dst"))  # type: ignore
+            if sinks:
+                for sink in sinks:
+                    try:
+                        await sink(event)
+                    except Exception as e:
+                        self._handler_error(sink, event, e)
 
     def emit_sync(self, event: dict | None = None, **kwargs):
         """
         Emit event from synchronous code.
 
+        The event is queued and delivered by a background task. Events that do not
+        fit in the queue are handled according to the overflow policy and counted
+        in `dropped`. With the BLOCK policy, QueueFull is raised instead since
+        waiting would block the event loop.
+
         Args:
             event (dict)
         """
-        if self.event_queue is None:
-            try:
-                self.event_queue = asyncio.Queue(maxsize=self.sync_queue_size)
-            except AttributeError:
-                # MicroPython does not currently provide asyncio.Queue
-                from asyncio_extra import queue  # type: ignore
+        if event is None:
+            event = kwargs
+        else:
+            event.update(kwargs)
+        self._sync_queue().put_nowait(event)
+        # Note: no log message on overflow - as that would generate another emit_sync event!
 
-                self.event_queue = queue.Queue(maxsize=self.sync_queue_size)
-            asyncio.create_task(self._sync_emit_task(self.pause))
+    def emit_threadsafe(self, event: dict | None = None, **kwargs):
+        """
+        Emit event from another thread, e.g. a driver or a blocking library.
 
-        try:
-            if event is None:
-                event = kwargs
+        Events are handed to the event loop in batches of up to `sync_queue_size`
+        events and delivered in order. With the `thread_overflow` policy BLOCK
+        (default) the calling thread waits for room rather than dropping events.
+
+        Call `enable_threadsafe` (or use `run_in_thread`) from the event loop first.
+
+        Args:
+            event (dict)
+        """
+        if self._inbox is None:
+            raise RuntimeError("emit_threadsafe: call bus.enable_threadsafe() from the event loop first")
+        if event is None:
+            event = kwargs
+        else:
+            event.update(kwargs)
+        self._inbox.put(event)
+
+    def enable_threadsafe(self):
+        """Attach the bus to the running event loop to accept events from other threads."""
+        if self._inbox is None:
+            # CPython only - MicroPython has no threading module
+            from .threadsafe import ThreadInbox
+
+            self._inbox = ThreadInbox(self, asyncio.get_event_loop())
+
+    async def run_in_thread(self, func, *args, executor=None):
+        """
+        Run blocking func(*args) in a thread pool and return its result.
+
+        func may post events with `emit_threadsafe`.
+
+        Example:
+            def reader(port):
+                while True:
+                    bus.emit_threadsafe(topic="!state", uid=uid, value=port.readline())
+
+            await bus.run_in_thread(reader, serial_port)
+        """
+        self.enable_threadsafe()
+        return await asyncio.get_event_loop().run_in_executor(executor, func, *args)
+
+    def _executor(self, kind):
+        """Executor for `subscribe(..., executor=kind)`, created on first use."""
+        if not isinstance(kind, str):
+            return kind
+        executor = self._executors.get(kind)
+        if executor is None:
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+            if kind == "thread":
+                executor = ThreadPoolExecutor(self.executor_workers, thread_name_prefix="bus")
+            else:
+                executor = ProcessPoolExecutor(self.executor_workers)
+            self._executors[kind] = executor
+        return executor
+
+    def shutdown_executors(self, wait=True):
+        """Shut down the thread and process pools of executor subscriptions."""
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
+        self._executors = {}
+
+    @property
+    def dropped(self) -> int:
+        """Number of emit_sync and emit_threadsafe events dropped due to queue overflow."""
+        dropped = 0 if self.event_queue is None else self.event_queue.dropped
+        return dropped if self._inbox is None else dropped + self._inbox.dropped
+
+    def _sync_queue(self) -> EventQueue | LaneQueue:
+        """The emit_sync queue, created (and drained) on first use."""
+        if self.event_queue is None:
+            if self.lanes:
+                self.event_queue = LaneQueue(
+                    self.lanes, self.sync_queue_size, self.overflow, self.coalesce, self.lane_quota
+                )
             else:
-                event.update(kwargs)
-            self.event_queue.put_nowait(event)
-        except asyncio.QueueFull:
-            pass
-            # Note: no log message - as that would generate another emit_sync event!
-            # print("***** sync event queue overflow", event)
+                self.event_queue = EventQueue(self.sync_queue_size, self.overflow, self.coalesce)
+            asyncio.create_task(self._sync_emit_task(self.pause))
+        return self.event_queue
 
     async def _sync_emit_task(self, pause):
-        """Helper task to send sync events."""
+        """Helper task to send sync events: deliver everything queued, then yield."""
+        queue = self.event_queue
         while True:
-            event = await self.event_queue.get()  # type: ignore
-            await self.emit(event)
-            await asyncio.sleep(pause)
+            batch = await queue.get_batch()  # type: ignore
+            if self.metrics is not None:
+                self.metrics.record_queue_depth(len(batch))
+            for event in batch:
+                await self.emit(event)
+            await self.clock.sleep(pause)
+
+    def _build_plan(self, topic: str) -> tuple:
+        """
+        Compile and cache the dispatch plan for topic.
 
-    async def _call_handler(self, funcs: list[Callback], event):
+        The plan merges the topic handlers, the handlers of matching patterns
+        (shortest prefix first) and the '*' handlers and classifies each as sync
+        or async and resolves its timeout. If neither the topic nor any pattern has handlers
+        or Bus.listen waiters, the '!' handlers take their place. Plans are discarded
+        whenever the subscriptions or the waiting topics change.
+        """
+        subs = []
+        for pattern in self._match_patterns(topic):
+            subs += self.listeners[pattern]
+        if topic in self.listeners:
+            subs = list(self.listeners[topic]) + subs
+        elif not subs and topic not in self._waiters:
+            subs = list(self.listeners.get(NO_HANDLER, ()))
+        subs += self.listeners.get(ALL_HANDLER, ())
+        default = self.handler_timeout
+        plan = tuple(
+            (sub.handler, iscoroutinefunction(sub.handler), sub.as_event, sub.timeout or default)
+            if sub.pool is None
+            else (sub.pool.put, True, True, None)
+            for sub in subs
+        )
+        self._plans[topic] = plan
+        return plan
+
+    @staticmethod
+    def _is_pattern(topic: str) -> bool:
+        return len(topic) > 1 and topic[-1] == WILDCARD
+
+    def _insert_pattern(self, pattern: str):
+        """Add pattern to the prefix trie."""
+        node = self._trie
+        for c in pattern[:-1]:
+            node = node.setdefault(c, {})
+        node[""] = pattern
+
+    def _remove_pattern(self, pattern: str):
+        """Remove pattern from the prefix trie, pruning nodes left empty."""
+        nodes = [self._trie]
+        for c in pattern[:-1]:
+            nodes.append(nodes[-1][c])
+        del nodes[-1][""]
+        for i in range(len(pattern) - 2, -1, -1):
+            if nodes[i + 1]:
+                break
+            del nodes[i][pattern[i]]
+
+    def _match_patterns(self, topic: str) -> list:
+        """Patterns matching topic, shortest prefix first."""
+        matches = []
+        node = self._trie
+        for c in topic or "":
+            node = node.get(c)
+            if node is None:
+                break
+            if "" in node:
+                matches.append(node[""])
+        return matches
+
+    async def _call_handler(self, plan: tuple, event):
         """Helper to call sync / async callbacks."""
-        for func in funcs:
-            try:
-                res = func(**event)
-                if isinstance(res, Awaitable):
+        kwargs = event if type(event) is dict else None  # Event: converted on first use
+        for func, is_async, as_event, timeout in plan:
+            if kwargs is None and not as_event:
+                kwargs = event.as_dict()
+            await self._invoke(func, is_async, as_event, timeout, event, kwargs)
+
+    async def _call_handler_timed(self, plan: tuple, event):
+        """_call_handler, recording handler latencies in metrics."""
+        metrics = self.metrics
+        kwargs = event if type(event) is dict else None  # Event: converted on first use
+        for func, is_async, as_event, timeout in plan:
+            if kwargs is None and not as_event:
+                kwargs = event.as_dict()
+            t0 = ticks_us()
+            if await self._invoke(func, is_async, as_event, timeout, event, kwargs):
+                metrics.record(func, ticks_diff(ticks_us(), t0))  # type: ignore
+
+    async def _call_handler_concurrent(self, plan: tuple, event):
+        """
+        Helper to call callbacks concurrently.
+
+        Sync handlers run first, in plan order. The async handlers then run
+        concurrently, at most `concurrency` at a time. Errors are reported per
+        handler and do not affect the other handlers.
+        """
+        metrics = self.metrics
+        kwargs = event if type(event) is dict else None  # Event: converted on first use
+        pending = []
+        for func, is_async, as_event, timeout in plan:
+            if kwargs is None and not as_event:
+                kwargs = event.as_dict()
+            if is_async:
+                pending.append((func, as_event, timeout))
+                continue
+            t0 = ticks_us()
+            if await self._invoke(func, False, as_event, timeout, event, kwargs) and metrics is not None:
+                metrics.record(func, ticks_diff(ticks_us(), t0))
+        if not pending:
+            return
+        it = iter(pending)
+
+        async def worker():
+            for func, as_event, timeout in it:
+                t0 = ticks_us()
+                if await self._invoke(func, True, as_event, timeout, event, kwargs) and metrics is not None:
+                    metrics.record(func, ticks_diff(ticks_us(), t0))
+
+        n = min(self.concurrency, len(pending))  # type: ignore
+        if n == 1:
+            await worker()
+        else:
+            await asyncio.gather(*[worker() for _ in range(n)])
+
+    async def _invoke(self, func, is_async: bool, as_event: bool, timeout: float | None, event, kwargs) -> bool:
+        """
+        Call handler func, subject to the circuit breaker and its time budget.
+
+        Failures are reported with _handler_failed, a success resets the failure
+        count. Returns False if the circuit breaker skipped func.
+        """
+        if self._open and self._skip(func):
+            return False
+        try:
+            if timeout is None:
+                res = func(event) if as_event else func(**kwargs)
+                # sync handlers normally return None: skip the isinstance check
+                if is_async or (res is not None and isinstance(res, Awaitable)):
                     await res
-            except TypeError as e:
-                print(
-                    f"***** ERROR in bus._call_handler: {event}",
-                    e,
-                )
+            else:
+                await self._call_budgeted(func, as_event, timeout, event, kwargs)
+        except Exception as e:
+            self._handler_failed(func, event, e)
+        else:
+            if self._failures and func in self._failures:
+                del self._failures[func]
+        return True
+
+    async def _call_budgeted(self, func, as_event: bool, timeout: float, event, kwargs):
+        """Call handler with a time budget, raise asyncio.TimeoutError if it is exceeded."""
+        t0 = ticks_us()
+        res = func(event) if as_event else func(**kwargs)
+        if res is not None and isinstance(res, Awaitable):
+            await self.clock.wait_for(res, timeout)
+        elif ticks_diff(ticks_us(), t0) > timeout * 1_000_000:
+            # sync handlers cannot be interrupted, count it as failed
+            raise asyncio.TimeoutError()
+
+    def _skip(self, func) -> bool:
+        """Circuit breaker: True while func is not to be called."""
+        until = self._open.get(func)
+        if until is None:
+            return False
+        if self.clock.time() < until:
+            return True
+        # half open: try once more, a single failure opens the breaker again
+        del self._open[func]
+        self._failures[func] = self.breaker_threshold - 1  # type: ignore
+        return False
+
+    def _handler_failed(self, func: Callback, event, e: Exception):
+        """Report failure of handler func and open the circuit breaker if it keeps failing."""
+        timeout = isinstance(e, asyncio.TimeoutError)
+        if timeout:
+            print(f"***** TIMEOUT in bus._call_handler: {handler_name(func)}, {event}")
+        else:
+            self._handler_error(func, event, e)
+        if self.metrics is not None:
+            self.metrics.record_failure(func, timeout)
+        if self.breaker_threshold is None:
+            return
+        failures = self._failures.get(func, 0) + 1
+        if failures >= self.breaker_threshold:
+            print(f"***** bus: {handler_name(func)} failed {failures} times, skipped for {self.breaker_reset}s")
+            self._open[func] = self.clock.time() + self.breaker_reset
+            failures = 0
+            if self.metrics is not None:
+                self.metrics.record_trip(func)
+        self._failures[func] = failures
+
+    @property
+    def open_circuits(self) -> list:
+        """Handlers currently skipped by the circuit breaker."""
+        return list(self._open)
+
+    def _handler_error(self, func: Callback, event: dict, e: Exception):
+        """Report exception raised by handler func."""
+        print(
+            f"***** ERROR in bus._call_handler: {event}",
+            e,
+        )
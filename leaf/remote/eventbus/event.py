@@ -0,0 +1,98 @@
+_MISSING = object()
+
+
+class Event:
+    """
+    Compact event.
+
+    Common fields are stored in slots, anything else in the `extra` dict. Supports
+    the subset of the dict interface used by the bus (`get`, `[]`, `in`, `update`),
+    so it can be emitted wherever a dict event is accepted.
+
+    Handlers subscribed with `as_event=True` receive the emitted event object
+    directly instead of keyword arguments, which saves a dict per handler call.
+
+    Example:
+        await bus.emit(Event("!state", uid=uid, value=12.8, timestamp=time.time()))
+
+        @bus.on("!state", as_event=True)
+        def state_listener(event):
+            print(event.uid, event.value)
+    """
+
+    __slots__ = ("topic", "src", "dst", "uid", "value", "timestamp", "extra")
+
+    FIELDS = ("topic", "src", "dst", "uid", "value", "timestamp")
+
+    def __init__(
+        self,
+        topic=_MISSING,
+        *,
+        src=_MISSING,
+        dst=_MISSING,
+        uid=_MISSING,
+        value=_MISSING,
+        timestamp=_MISSING,
+        **extra,
+    ):
+        self.topic = topic
+        self.src = src
+        self.dst = dst
+        self.uid = uid
+        self.value = value
+        self.timestamp = timestamp
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, event: dict) -> "Event":
+        return cls(**event)
+
+    def as_dict(self) -> dict:
+        """Event as a dict, e.g. for keyword argument handlers or serialization."""
+        d = {}
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                d[key] = value
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        return self.extra.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def update(self, other):
+        for key, value in other.items():
+            self[key] = value
+
+    def keys(self):
+        return self.as_dict().keys()
+
+    def items(self):
+        return self.as_dict().items()
+
+    def __eq__(self, other):
+        if isinstance(other, Event):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __repr__(self):
+        return f"Event({self.as_dict()})"
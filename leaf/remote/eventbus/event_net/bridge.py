@@ -1,14 +1,17 @@
 import asyncio
-import json
 import logging
-from io import StringIO
 
-from .. import bus
+from .. import bus as default_bus
+from ..event import Event
+from .codec import CODECS, COMPRESSIONS, JSON, FrameDecoder, FrameEncoder, SymbolTable
 from .transport import Transport
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# announces the wire formats a bridge accepts, consumed by the peer bridge
+WIRE = "!wire"
+
 
 class Bridge:
     """
@@ -16,54 +19,157 @@ class Bridge:
 
     Usage:
     - Instantiate with appropriate transport (e.g. websocket or espnet).
-    - Set dst_filter (for events to pass to peer). May be updated after calling run.
+    - Set dst_filter (for events to pass to peer, e.g. {peer, "#clients"}). May be updated after calling run.
 
     Configuration:
     - `receive_timeout` - time to keep connection open when no messages are received [seconds]
-    - `max_latency` - flush is called at least at this interval [seconds]
+    - `max_latency` - upper bound of the batching delay [seconds]
+    - `min_latency` - lower bound of the batching delay once the round trip time is known [seconds]
+    - `rtt_factor` - batching delay as a fraction of the round trip time
     - `size_threshold` - flush called automatically when buffer size exceeds this
+    - `coalesce` - topics coalesced by (topic, uid) while waiting for flush, e.g. {"!state"}
+    - `urgent` - control topics sent ahead of queued events and, in received frames, dispatched
+      ahead of the other events, e.g. ("?act",)
+    - `codecs` - wire codecs accepted from the peer, preferred first (see codec.py)
+    - `compressions` - frame compressions accepted from the peer, e.g. ("deflate",), () to disable
+    - `symbols` - size of the table interning topics, uids, destinations and keys, 0 to disable
+    - `symbol_peers` - number of peers whose symbol tables are kept, least recently connected are dropped
+    - `delta` - delta encode `!state` values and timestamps, with a keyframe every `delta` events of a uid,
+      0 to disable (default)
+
+    Wire format negotiation: when `run` starts, the bridge announces the codecs and
+    compressions it accepts in a `!wire` event. Each side sends with the first of
+    its own codecs (and compressions) the peer announced, or uncompressed JSON if
+    the peer sent no announcement (older versions). Events are interned if both
+    sides announce `symbols`, and `!state` events delta encoded if both announce
+    `delta`. The symbol table of a peer is kept across connections and resent
+    when a new connection starts.
+
+    Batching: events routed to the peer are queued and sent together when the
+    buffer exceeds `size_threshold` or the oldest queued event is `latency`
+    seconds old. The latency budget is `rtt_factor` times the round trip time
+    (measured from requests and their responses), at least the time a frame
+    takes to send, and at most `max_latency`. Requests (`?` topics, e.g. `?act`)
+    and responses (events with a `rid`) flush the queue at once, as do events
+    arriving further apart, on average, than the budget (batching would only
+    delay them).
+
+    Timers run on `bus.clock`, so bridges can be simulated in virtual time.
     """
 
     # time to keep connection open when no messages are receivedan [seconds]
     receive_timeout = 10
     max_latency = 0.5
+    min_latency = 0.005
+    rtt_factor = 0.5
     size_threshold = 4000
+    coalesce = ()
+    urgent = ("?act",)
+    codecs = CODECS
+    compressions = COMPRESSIONS
+    symbols = 1024
+    symbol_peers = 64
+    delta = 0
+
+    # (leaf_id, peer) -> SymbolTable of events sent to peer, kept across connections, most recent last
+    _symbol_tables = {}
 
-    def __init__(self, peer: str, transport: Transport):
+    def __init__(self, peer: str, transport: Transport, bus=None):
         """
         Create server. Call serve() to start serving.
 
         Args:
             transport (Transport): The transport object used for communication.
+            bus (Bus): Local bus. Default: eventbus.bus.
         """
+        self.bus = default_bus if bus is None else bus
         self.peer = peer
-        self.dst_filter = {peer}
         self.transport = transport
-        self._buffer = StringIO()
+        self._encoder = FrameEncoder()  # wire format of sent frames, updated by negotiation
+        self._decoder = FrameDecoder()
+        self._lines = []  # encoded events waiting for flush
+        self._urgent_lines = []  # encoded urgent events, sent ahead of _lines
+        self._index = {}  # (topic, uid) -> position in _lines of coalesced events
+        self._size = 0  # characters (or bytes) in _lines
         self._closed = False
+        self._queued = asyncio.Event()  # set when the buffer receives its first event
+        self._flushed = asyncio.Event()  # set when the buffer is flushed
+        # link measurements (bus.clock seconds, exponentially weighted averages)
+        self.rtt = None  # round trip time of requests
+        self._requests = {}  # rid -> time sent
+        self._send_time = 0  # time taken by transport.send
+        self._interval = None  # between events routed to the peer
+        self._last = None  # time of last event routed to the peer
+        self._dst_filter = frozenset()
         # these stop / unsubscribe when connection is closed
-        bus.subscribe(self._sender_cb, "*")
-        bus.subscribe(self._bye_cb, "!bye")
+        self.dst_filter = {peer}
+        self._bye_sub = self.bus.subscribe(self._bye_cb, "!bye")
         self._flush_task = asyncio.create_task(self._timed_flush_task())
 
+    @property
+    def dst_filter(self) -> frozenset:
+        """Destinations of events passed to the peer."""
+        return self._dst_filter
+
+    @dst_filter.setter
+    def dst_filter(self, dsts):
+        # events are routed to the bridge by the bus (rather than filtered by the bridge)
+        dsts = frozenset(dsts)
+        for dst in self._dst_filter - dsts:
+            self.bus.remove_route(dst, self._sender_cb)
+        for dst in dsts - self._dst_filter:
+            self.bus.add_route(dst, self._sender_cb)
+        self._dst_filter = dsts
+
     async def run(self):
+        try:
+            await self._run()
+        finally:
+            if self._closed:
+                self._detach()
+
+    async def _run(self):
+        await self.emit(
+            {
+                "topic": WIRE,
+                "src": self.bus.LEAF_ID,
+                "dst": self.peer,
+                "codecs": list(self.codecs),
+                "compressions": list(self.compressions),
+                "symbols": self.symbols > 0,
+                "delta": self.delta > 0,
+            }
+        )
+        await self.flush()
         while not self._closed:
             for _ in range(2):
                 try:
                     # wait for events from client
-                    msg = await asyncio.wait_for(self.transport.receive(), self.receive_timeout)
-                    print(f"RECV Bridge.run: {bus.LEAF_ID}: {msg}")
+                    msg = await self.bus.clock.wait_for(self.transport.receive(), self.receive_timeout)
+                    print(f"RECV Bridge.run: {self.bus.LEAF_ID}: {msg}")
                     # post received events from client to local bus
-                    for event in msg.split("\n")[:-1]:
+                    events = self._decoder.decode(msg)
+                    if self.urgent:
+                        # control events do not wait for the handlers of telemetry in the same frame
+                        urgent = [event for event in events if event.get("topic") in self.urgent]
+                        if urgent:
+                            events = urgent + [event for event in events if event.get("topic") not in self.urgent]
+                    for event in events:
                         logger.debug(f"EMIT {event}")
-                        await bus.emit(json.loads(event))
+                        sent = self._requests.pop(event.get("rid"), None)
+                        if sent is not None:
+                            self.rtt = _average(self.rtt, self.bus.clock.time() - sent)
+                        if event.get("topic") == WIRE:
+                            await self._negotiate(event)
+                        else:
+                            await self.bus.emit(event)
                     break  # we got a message, back to while loop
                 except asyncio.TimeoutError:
                     # timeout - check if connection is still alive (client will reply with !echo)
                     await self.emit(
                         {
                             "topic": "?echo",
-                            "src": bus.LEAF_ID,
+                            "src": self.bus.LEAF_ID,
                             "dst": self.peer,
                             "data": "bridge.run: timeout",
                         }
@@ -79,46 +185,148 @@ class Bridge:
                 return
         logger.debug(f"CLOSED connection to {self.peer}")
 
-    async def emit(self, event: dict):
+    async def emit(self, event: dict | Event):
         """Queue event to send to client."""
-        json.dump(event, self._buffer)
-        self._buffer.write("\n")
-        if self._buffer.tell() > self.size_threshold:
+        line = self._encoder.event(event if type(event) is dict else event.as_dict())
+        if not self._lines and not self._urgent_lines:
+            # start the latency budget
+            self._queued.set()
+        if event.get("topic") in self.urgent:
+            self._urgent_lines.append(line)
+        else:
+            if self.coalesce and event.get("topic") in self.coalesce and "uid" in event:
+                key = (event["topic"], event["uid"])
+                i = self._index.get(key)
+                if i is not None:
+                    # supersede queued value, keep position
+                    self._size += len(line) - len(self._lines[i])
+                    self._lines[i] = line
+                    return
+                self._index[key] = len(self._lines)
+            self._lines.append(line)
+        self._size += len(line)
+        if self._size > self.size_threshold:
             await self.flush()
 
     async def flush(self):
         """Send queued events to client"""
-        data = self._buffer.getvalue()
-        if data and not self._closed:
-            # no need for timed flush again for a while ...
-            self._flush_task.cancel()
-            # allocate a new buffer
-            self._buffer = StringIO()
-            try:
-                logger.debug(f"SEND {data}")
-                await self.transport.send(data)
-            except Exception:
-                # something went wrong - assume the connection is lost
-                self._closed = True
+        await self._send(self._frame())
+
+    def _frame(self):
+        """Frame of the queued events, None if there are none. Starts a new buffer."""
+        if not (self._lines or self._urgent_lines) or self._closed:
+            return None
+        # no need for timed flush until the next event is queued
+        self._queued.clear()
+        self._flushed.set()
+        try:
+            return self._encoder.frame(self._urgent_lines + self._lines if self._urgent_lines else self._lines)
+        finally:
+            # start a new buffer
+            self._lines = []
+            self._urgent_lines = []
+            self._index = {}
+            self._size = 0
+
+    async def _send(self, data):
+        if data is None:
+            return
+        try:
+            logger.debug(f"SEND {data}")
+            t = self.bus.clock.time()
+            await self.transport.send(data)
+            self._send_time = _average(self._send_time, self.bus.clock.time() - t)
+        except Exception:
+            # something went wrong - assume the connection is lost
+            self._closed = True
+
+    @property
+    def latency(self) -> float:
+        """Batching delay [seconds]."""
+        budget = self.max_latency
+        if self.rtt is not None:
+            budget = max(self.min_latency, self.rtt * self.rtt_factor)
+        # sending frames faster than the link takes them only queues them
+        return min(self.max_latency, max(budget, self._send_time))
+
+    @property
+    def codec(self) -> str:
+        """Codec of sent frames."""
+        return self._encoder.codec
+
+    @property
+    def compression(self) -> str | None:
+        """Compression of sent frames."""
+        return self._encoder.compression
+
+    async def _negotiate(self, event):
+        """Peer announced the codecs and compressions it accepts."""
+        codec = _first(self.codecs, event.get("codecs")) or JSON
+        compression = _first(self.compressions, event.get("compressions"))
+        symbols = None
+        if self.symbols > 0 and event.get("symbols"):
+            key = (self.bus.LEAF_ID, self.peer)
+            tables = self._symbol_tables
+            symbols = tables.pop(key, None)
+            if symbols is None:
+                symbols = SymbolTable(self.symbols)
+                while tables and len(tables) >= self.symbol_peers:
+                    # e.g. one peer per web client: drop the least recently connected
+                    del tables[next(iter(tables))]
+            tables[key] = symbols
+        delta = self.delta if event.get("delta") else 0
+        encoder = self._encoder
+        if (codec, compression, symbols, delta) != (encoder.codec, encoder.compression, encoder.symbols, encoder.delta):
+            # frames hold a single codec: frame the queued events before switching,
+            # events queued while the frame is sent are encoded with the new codec
+            data = self._frame()
+            self._encoder = FrameEncoder(codec, compression, symbols, delta)
+            await self._send(data)
 
     async def close(self):
         """Explicitly close the connection. Happens automatically if connection to client is lost."""
         try:
             if not self._closed:
-                await self.emit({"topic": "!bye", "src": bus.LEAF_ID, "dst": self.peer})
+                await self.emit({"topic": "!bye", "src": self.bus.LEAF_ID, "dst": self.peer})
                 await self.flush()
         finally:
             self._closed = True
+            # let the flush task exit
+            self._queued.set()
+
+    def abort(self):
+        """Close the connection without notifying the peer and stop using the local bus."""
+        self._closed = True
+        self._detach()
 
-    async def _sender_cb(self, **event):
-        """Pass events from local bus to client."""
+    async def _sender_cb(self, event):
+        """Pass events routed to the peer from local bus to client."""
         if self._closed:
-            bus.unsubscribe(self._sender_cb)
-            bus.unsubscribe(self._bye_cb)
-        else:
-            if event.get("dst") in self.dst_filter:
-                await self.emit(event)
-                await self.flush()
+            self._detach()
+            return
+        now = self.bus.clock.time()
+        if self._last is not None:
+            self._interval = _average(self._interval, now - self._last)
+        self._last = now
+        await self.emit(event)
+        topic = event.get("topic") or ""
+        rid = event.get("rid")
+        if topic[:1] == "?" or rid is not None:
+            if topic[:1] == "?" and rid is not None:
+                if len(self._requests) > 16:
+                    # unanswered requests
+                    self._requests.clear()
+                self._requests[rid] = now
+            await self.flush()
+        elif self._interval is None or self._interval > self.latency:
+            # sparse events: no point waiting for others
+            await self.flush()
+
+    def _detach(self):
+        """Stop receiving events from the local bus."""
+        self.dst_filter = ()
+        self._bye_sub.cancel()
+        self._flush_task.cancel()
 
     async def _bye_cb(self, **event):
         """Handle bye event from client."""
@@ -127,8 +335,28 @@ class Bridge:
 
     async def _timed_flush_task(self):
         while not self._closed:
+            await self._queued.wait()
+            if self._closed:
+                break
+            if not self._queued.is_set():
+                # flushed before this task woke up
+                continue
+            self._flushed.clear()
             try:
-                await asyncio.sleep(self.max_latency)
+                # unless flushed earlier (e.g. size_threshold)
+                await self.bus.clock.wait_for(self._flushed.wait(), self.latency)
+            except asyncio.TimeoutError:
                 await self.flush()
-            except asyncio.CancelledError:
-                pass
+
+
+def _average(average, sample: float, weight: float = 0.125) -> float:
+    """Exponentially weighted moving average."""
+    return sample if average is None else average + weight * (sample - average)
+
+
+def _first(ours, theirs):
+    """First of ours (in order of preference) in theirs, or None."""
+    for x in ours:
+        if x in (theirs or ()):
+            return x
+    return None
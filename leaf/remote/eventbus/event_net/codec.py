@@ -0,0 +1,494 @@
+"""
+Wire codecs of the Bridge.
+
+- JSON: text frames, one json encoded event per line.
+- MSGPACK: binary frames, concatenated MessagePack encoded events.
+- DEFLATE: optional compression of frames (either codec). The compression
+  context persists across the frames of a connection, so strings repeated in
+  every frame compress to a few bytes. Compressed frames are binary and start
+  with 0xC1 (never used by MessagePack) and a flags byte.
+- Interning (either codec): topics, uids, destinations, sources and keys are
+  replaced by integer ids from a SymbolTable. Interned events are arrays
+  `[topic, uid, dst, src, key, value, key, value, ...]` (None for absent
+  fields). New ids are defined at the start of the frame that first uses them,
+  in a `{"!sym": [first_id, string, ...]}` record.
+- Delta encoding of `!state` events: `value` and `timestamp` are sent as
+  integer differences (in units of their last decimal place) from the values
+  of the uid in the previous frames, in a `"~": [value, timestamp]` field.
+  Entries are None (field sent as is), an int (delta) or `[decimals]`
+  (keyframe: field sent as is and becomes the base). Bases advance once per
+  frame, so every delta in a frame refers to what the peer already decoded.
+
+The MessagePack implementation is pure Python (it runs frozen on MicroPython)
+and covers the types used in events: None, bool, int (64 bit), float, str,
+bytes, list, tuple and dict.
+
+Frames are self describing, so receivers decode any of them regardless of what
+was negotiated.
+"""
+
+import json
+from struct import pack as _pack_struct
+from struct import unpack_from
+
+try:
+    import zlib
+
+    zlib.compressobj  # type: ignore
+except (ImportError, AttributeError):
+    # MicroPython: no streaming compression
+    zlib = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+DEFLATE = "deflate"
+
+CODECS = (MSGPACK, JSON)  # supported codecs, preferred first
+COMPRESSIONS = () if zlib is None else (DEFLATE,)
+
+# compressed frames: COMPRESSED, flags, deflate data
+COMPRESSED = 0xC1
+FLAG_MSGPACK = 0x01  # else JSON
+FLAG_RESET = 0x02  # first frame of a new compression context
+
+SYM = "!sym"  # key of symbol definitions
+DELTA = "~"  # key of delta codes
+_DELTA_FIELDS = ("value", "timestamp")
+_INT64 = -(2**63)  # scaled values and deltas are signed 64 bit ints
+
+# fields interned at fixed positions of interned events
+_POSITIONS = {"uid": 1, "dst": 2, "src": 3}
+
+
+class SymbolTable:
+    """
+    Strings interned on the wire, assigned ids in order of first use.
+
+    Tables outlive connections: a new connection starts by resending the table,
+    so ids stay the same across reconnects. Strings beyond `size` are sent as is.
+    """
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.ids = {}  # string -> id
+        self.strings = []  # id -> string
+
+    def intern(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            if len(self.strings) >= self.size:
+                return s
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+
+class FrameEncoder:
+    """Sending side of a connection: encodes events and assembles them into frames."""
+
+    def __init__(
+        self, codec: str = JSON, compression: str | None = None, symbols: SymbolTable | None = None, delta: int = 0
+    ):
+        """
+        Args:
+            codec (str): JSON or MSGPACK.
+            compression (str): DEFLATE or None.
+            symbols (SymbolTable): Intern strings if not None.
+            delta (int): Delta encode !state events, with a keyframe every `delta` events of a uid. 0: disabled.
+        """
+        self.codec = codec
+        self.compression = compression
+        self.symbols = symbols
+        self.delta = delta
+        self._defined = 0  # symbols[:_defined] were sent on this connection
+        self._bases = {}  # uid -> [(scaled, decimals) of value, of timestamp, deltas since keyframe]
+        self._next = {}  # bases after the current frame
+        self._deflate = None
+        if compression == DEFLATE:
+            self._deflate = zlib.compressobj(9, zlib.DEFLATED, -15)  # type: ignore
+            self._flags = FLAG_RESET | (FLAG_MSGPACK if codec == MSGPACK else 0)
+
+    def event(self, event: dict) -> str | bytes:
+        """Encoded event. Frames are the concatenation of encoded events."""
+        if self.delta and event.get("topic") == "!state" and "uid" in event:
+            event, bases = self._delta(event)
+            data = self._encode(event)
+            # like the decoder, only events that are sent with delta codes move the bases
+            if DELTA in event:
+                self._next[event["uid"]] = bases
+            return data
+        return self._encode(event)
+
+    def _encode(self, event: dict) -> str | bytes:
+        symbols = self.symbols
+        if symbols is None:
+            return encode(self.codec, event)
+        intern = symbols.intern
+        rec = [intern(event.get("topic")), None, None, None]
+        for key, value in event.items():
+            if key == "topic":
+                continue
+            i = _POSITIONS.get(key)
+            if i is not None and type(value) is str:
+                rec[i] = intern(value)
+            else:
+                rec.append(intern(key))
+                rec.append(value)
+        return encode(self.codec, rec)
+
+    def _delta(self, event: dict):
+        """Delta encoded event and the bases of its uid after it is sent."""
+        uid = event["uid"]
+        base = self._bases.get(uid)
+        key = base is None or base[2] + 1 >= self.delta
+        nxt = [None, None, 0] if key else [base[0], base[1], base[2] + 1]
+        codes = [None, None]
+        out = None
+        for i, field in enumerate(_DELTA_FIELDS):
+            x = event.get(field)
+            d = _decimals(x)
+            if d is None:
+                continue
+            if not key and base[i] is not None:
+                scaled, decimals = base[i]
+                if (d == 0) == (decimals == 0) and d <= decimals:
+                    s = round(x * 10**decimals)
+                    if _unscale(s, decimals) == x and _INT64 <= s - scaled < -_INT64:
+                        out = out or dict(event)
+                        del out[field]
+                        codes[i] = s - scaled
+                        nxt[i] = (s, decimals)
+                        continue
+            s = round(x * 10**d)
+            if _INT64 <= s < -_INT64:
+                codes[i] = [d]
+                nxt[i] = (s, d)
+            # else: sent as is
+        if codes == [None, None]:
+            return event, nxt
+        out = out or dict(event)
+        out[DELTA] = codes
+        return out, nxt
+
+    def frame(self, pieces: list) -> str | bytes:
+        """Frame from encoded events."""
+        symbols = self.symbols
+        if symbols is not None and self._defined < len(symbols.strings):
+            # define the symbols used for the first time (on this connection) before the events using them
+            pieces = [encode(self.codec, {SYM: [self._defined] + symbols.strings[self._defined :]})] + pieces
+            self._defined = len(symbols.strings)
+        if self._next:
+            self._bases.update(self._next)
+            self._next = {}
+        data = ("" if self.codec == JSON else b"").join(pieces)
+        if self._deflate is None:
+            return data
+        if self.codec == JSON:
+            data = data.encode()  # type: ignore
+        header = bytes((COMPRESSED, self._flags))
+        self._flags &= ~FLAG_RESET
+        return header + self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)  # type: ignore
+
+
+class FrameDecoder:
+    """Receiving side of a connection."""
+
+    def __init__(self):
+        self._inflate = None
+        self._symbols = {}  # id -> string
+        self._bases = {}  # uid -> [(scaled, decimals) of value, of timestamp]
+
+    def decode(self, frame: str | bytes) -> list:
+        """Events in frame."""
+        if isinstance(frame, str) or frame[0] != COMPRESSED:
+            objs = decode(frame)
+        else:
+            flags = frame[1]
+            if flags & FLAG_RESET or self._inflate is None:
+                self._inflate = zlib.decompressobj(-15)  # type: ignore
+            data = self._inflate.decompress(frame[2:])
+            objs = unpack_all(data) if flags & FLAG_MSGPACK else decode(data.decode())
+        events = []
+        nxt = {}
+        for obj in objs:
+            if type(obj) is list:
+                obj = self._expand(obj)
+            elif SYM in obj and "topic" not in obj:
+                first, *strings = obj[SYM]
+                for i, s in enumerate(strings, first):
+                    self._symbols[i] = s
+                continue
+            if DELTA in obj and not self._undelta(obj, nxt):
+                continue
+            events.append(obj)
+        self._bases.update(nxt)
+        return events
+
+    def _undelta(self, event: dict, nxt: dict) -> bool:
+        """Restore delta encoded fields. False if the base is unknown (wait for the next keyframe)."""
+        uid = event["uid"]
+        base = self._bases.get(uid) or [None, None]
+        # like the encoder, the last event of a uid in the frame sets its bases
+        new = nxt[uid] = list(base)
+        for i, code in enumerate(event.pop(DELTA)):
+            field = _DELTA_FIELDS[i]
+            if type(code) is int:
+                if base[i] is None:
+                    return False
+                scaled, decimals = base[i]
+                scaled += code
+                event[field] = _unscale(scaled, decimals)
+                new[i] = (scaled, decimals)
+            elif code is not None:
+                decimals = code[0]
+                new[i] = (round(event[field] * 10**decimals), decimals)
+        return True
+
+    def _expand(self, rec: list) -> dict:
+        """Event from interned event."""
+        symbols = self._symbols
+        topic = rec[0]
+        event = {"topic": symbols[topic] if type(topic) is int else topic}
+        for key, i in _POSITIONS.items():
+            value = rec[i]
+            if value is not None:
+                event[key] = symbols[value] if type(value) is int else value
+        for i in range(4, len(rec), 2):
+            key = rec[i]
+            event[symbols[key] if type(key) is int else key] = rec[i + 1]
+        return event
+
+
+def _decimals(x):
+    """Decimal places (up to 6) that represent number x exactly, 0 for int, None if there are none."""
+    t = type(x)
+    if t is int:
+        return 0
+    if t is not float or x - x != 0:  # not a number, nan, inf
+        return None
+    for d in range(1, 7):
+        if _unscale(round(x * 10**d), d) == x:
+            return d
+    return None
+
+
+def _unscale(scaled: int, decimals: int):
+    return scaled / 10**decimals if decimals else scaled
+
+
+def encode(codec: str, event: dict) -> str | bytes:
+    """Encode event for a frame. Frames are the concatenation of encoded events."""
+    if codec == MSGPACK:
+        return packb(event)
+    return json.dumps(event) + "\n"
+
+
+def decode(frame: str | bytes) -> list:
+    """Events in a frame."""
+    if isinstance(frame, str):
+        return [json.loads(line) for line in frame.split("\n")[:-1]]
+    return unpack_all(frame)
+
+
+def packb(obj) -> bytes:
+    """MessagePack encoding of obj."""
+    buf = bytearray()
+    _pack(obj, buf)
+    return bytes(buf)
+
+
+def unpack_all(data: bytes) -> list:
+    """Decode concatenated MessagePack objects."""
+    objs = []
+    i = 0
+    n = len(data)
+    while i < n:
+        obj, i = _unpack(data, i)
+        objs.append(obj)
+    return objs
+
+
+def unpackb(data: bytes):
+    """Decode a single MessagePack object."""
+    obj, _ = _unpack(data, 0)
+    return obj
+
+
+def _pack(obj, buf: bytearray):
+    t = type(obj)
+    if t is str:
+        b = obj.encode()
+        n = len(b)
+        if n < 32:
+            buf.append(0xA0 | n)
+        elif n < 0x100:
+            buf.append(0xD9)
+            buf.append(n)
+        elif n < 0x10000:
+            buf += _pack_struct(">BH", 0xDA, n)
+        else:
+            buf += _pack_struct(">BI", 0xDB, n)
+        buf += b
+    elif t is int:
+        if 0 <= obj < 0x80:
+            buf.append(obj)
+        elif -32 <= obj < 0:
+            buf.append(obj & 0xFF)
+        elif obj > 0:
+            if obj < 0x100:
+                buf.append(0xCC)
+                buf.append(obj)
+            elif obj < 0x10000:
+                buf += _pack_struct(">BH", 0xCD, obj)
+            elif obj < 0x100000000:
+                buf += _pack_struct(">BI", 0xCE, obj)
+            elif obj < 0x10000000000000000:
+                buf += _pack_struct(">BQ", 0xCF, obj)
+            else:
+                raise ValueError(f"int out of range: {obj}")
+        elif obj >= -0x80:
+            buf += _pack_struct(">Bb", 0xD0, obj)
+        elif obj >= -0x8000:
+            buf += _pack_struct(">Bh", 0xD1, obj)
+        elif obj >= -0x80000000:
+            buf += _pack_struct(">Bi", 0xD2, obj)
+        elif obj >= -0x8000000000000000:
+            buf += _pack_struct(">Bq", 0xD3, obj)
+        else:
+            raise ValueError(f"int out of range: {obj}")
+    elif t is float:
+        buf += _pack_struct(">Bd", 0xCB, obj)
+    elif obj is None:
+        buf.append(0xC0)
+    elif t is bool:
+        buf.append(0xC3 if obj else 0xC2)
+    elif t is dict:
+        n = len(obj)
+        if n < 16:
+            buf.append(0x80 | n)
+        elif n < 0x10000:
+            buf += _pack_struct(">BH", 0xDE, n)
+        else:
+            buf += _pack_struct(">BI", 0xDF, n)
+        for key, value in obj.items():
+            _pack(key, buf)
+            _pack(value, buf)
+    elif t is list or t is tuple:
+        n = len(obj)
+        if n < 16:
+            buf.append(0x90 | n)
+        elif n < 0x10000:
+            buf += _pack_struct(">BH", 0xDC, n)
+        else:
+            buf += _pack_struct(">BI", 0xDD, n)
+        for item in obj:
+            _pack(item, buf)
+    elif t is bytes or t is bytearray:
+        n = len(obj)
+        if n < 0x100:
+            buf.append(0xC4)
+            buf.append(n)
+        elif n < 0x10000:
+            buf += _pack_struct(">BH", 0xC5, n)
+        else:
+            buf += _pack_struct(">BI", 0xC6, n)
+        buf += obj
+    # subclasses, e.g. IntEnum
+    elif isinstance(obj, str):
+        _pack(str(obj), buf)
+    elif isinstance(obj, int):
+        _pack(int(obj), buf)
+    elif isinstance(obj, float):
+        _pack(float(obj), buf)
+    elif isinstance(obj, dict):
+        _pack(dict(obj), buf)
+    elif isinstance(obj, (list, tuple)):
+        _pack(list(obj), buf)
+    else:
+        raise TypeError(f"Object of type {t.__name__} is not MessagePack serializable")
+
+
+def _unpack(data, i: int):
+    b = data[i]
+    i += 1
+    if b < 0x80:
+        return b, i
+    if b >= 0xE0:
+        return b - 0x100, i
+    if 0xA0 <= b < 0xC0:
+        n = b & 0x1F
+        return data[i : i + n].decode(), i + n
+    if 0x80 <= b < 0x90:
+        return _unpack_map(data, i, b & 0x0F)
+    if 0x90 <= b < 0xA0:
+        return _unpack_array(data, i, b & 0x0F)
+    if b == 0xC0:
+        return None, i
+    if b == 0xC2:
+        return False, i
+    if b == 0xC3:
+        return True, i
+    if b == 0xCB:
+        return unpack_from(">d", data, i)[0], i + 8
+    if b == 0xCA:
+        return unpack_from(">f", data, i)[0], i + 4
+    fmt = _FIXED.get(b)
+    if fmt is not None:
+        fmt, size = fmt
+        return unpack_from(fmt, data, i)[0], i + size
+    length = _LENGTH.get(b)
+    if length is None:
+        raise ValueError(f"Invalid MessagePack type 0x{b:02x}")
+    fmt, size, kind = length
+    n = unpack_from(fmt, data, i)[0]
+    i += size
+    if kind == 0:
+        return data[i : i + n].decode(), i + n
+    if kind == 1:
+        return bytes(data[i : i + n]), i + n
+    if kind == 2:
+        return _unpack_array(data, i, n)
+    return _unpack_map(data, i, n)
+
+
+def _unpack_map(data, i: int, n: int):
+    d = {}
+    for _ in range(n):
+        key, i = _unpack(data, i)
+        d[key], i = _unpack(data, i)
+    return d, i
+
+
+def _unpack_array(data, i: int, n: int):
+    items = []
+    for _ in range(n):
+        item, i = _unpack(data, i)
+        items.append(item)
+    return items, i
+
+
+# fixed size ints: type -> (struct format, size)
+_FIXED = {
+    0xCC: (">B", 1),
+    0xCD: (">H", 2),
+    0xCE: (">I", 4),
+    0xCF: (">Q", 8),
+    0xD0: (">b", 1),
+    0xD1: (">h", 2),
+    0xD2: (">i", 4),
+    0xD3: (">q", 8),
+}
+
+# length prefixed: type -> (struct format of length, size, kind: 0 str, 1 bin, 2 array, 3 map)
+_LENGTH = {
+    0xD9: (">B", 1, 0),
+    0xDA: (">H", 2, 0),
+    0xDB: (">I", 4, 0),
+    0xC4: (">B", 1, 1),
+    0xC5: (">H", 2, 1),
+    0xC6: (">I", 4, 1),
+    0xDC: (">H", 2, 2),
+    0xDD: (">I", 4, 2),
+    0xDE: (">H", 2, 3),
+    0xDF: (">I", 4, 3),
+}
@@ -7,11 +7,15 @@ class Transport:
         * automatic reconnection
     """
 
-    async def send(self, message: str):
-        """Send message to peer. Raise Exception on failure (e.g. connection lost)."""
+    async def send(self, message: str | bytes):
+        """
+        Send message to peer. Raise Exception on failure (e.g. connection lost).
+
+        Messages are text (str) or binary (bytes) and must be delivered as such.
+        """
         raise NotImplementedError
 
-    async def receive(self) -> str:
+    async def receive(self) -> str | bytes:
         """Receive message from peer. Raise Exception on failure (e.g. connection lost)."""
         raise NotImplementedError
 
@@ -25,8 +29,15 @@ class AioTransport(Transport):
     def __init__(self, ws):
         self.ws = ws
 
-    async def send(self, message: str):
-        await self.ws.send_str(message)
+    async def send(self, message: str | bytes):
+        if isinstance(message, str):
+            await self.ws.send_str(message)
+        else:
+            await self.ws.send_bytes(message)
 
-    async def receive(self) -> str:
-        return await self.ws.receive_str()
+    async def receive(self) -> str | bytes:
+        msg = await self.ws.receive()
+        if not isinstance(msg.data, (str, bytes)):
+            # close or error
+            raise ConnectionError(f"websocket: {msg.type}")
+        return msg.data
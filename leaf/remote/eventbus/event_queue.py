@@ -0,0 +1,169 @@
+import asyncio
+from collections import deque
+
+# overflow policies
+DROP_NEWEST = "drop-newest"  # discard the event being added
+DROP_OLDEST = "drop-oldest"  # discard the oldest queued event to make room
+BLOCK = "block"  # put waits for room, put_nowait raises QueueFull
+
+# priority lanes
+HIGH = 0  # e.g. control events such as ?act
+LOW = 1  # e.g. telemetry such as !state and !log
+
+
+class QueueFull(Exception):
+    pass
+
+
+class EventQueue:
+    """
+    Bounded FIFO of events, drained in batches.
+
+    Optionally, events of selected topics are coalesced by (topic, uid): a new value
+    for a key that is still queued replaces the queued event and keeps its position.
+    Memory is then bounded by the number of distinct entities rather than the event rate.
+
+    Not thread safe - use from the event loop only.
+
+    Attributes:
+        dropped (int): Number of events discarded due to overflow.
+    """
+
+    def __init__(self, maxsize: int = 20, policy: str = DROP_NEWEST, coalesce=()):
+        """
+        Args:
+            maxsize (int): Maximum number of queued events.
+            policy (str): What to do when the queue is full: DROP_NEWEST, DROP_OLDEST, or BLOCK.
+            coalesce: Topics to coalesce by (topic, uid), e.g. ("!state",).
+        """
+        assert policy in (DROP_NEWEST, DROP_OLDEST, BLOCK), f"Invalid overflow policy: {policy}"
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self.coalesce = set(coalesce)
+        self._items = deque((), maxsize)  # events, or (topic, uid) keys of coalesced events
+        self._latest = {}  # (topic, uid) -> latest queued event
+        self._ready = asyncio.Event()  # set when events are queued
+        self._room = asyncio.Event()  # set when events are removed
+
+    def __len__(self):
+        return len(self._items)
+
+    def put_nowait(self, event) -> bool:
+        """Queue event. Returns False if an event was dropped."""
+        item = event
+        if self.coalesce and event.get("topic") in self.coalesce and "uid" in event:
+            item = (event["topic"], event["uid"])
+            if item in self._latest:
+                # supersede queued value, keep queue position
+                self._latest[item] = event
+                return True
+        items = self._items
+        full = len(items) >= self.maxsize
+        if full:
+            if self.policy == BLOCK:
+                raise QueueFull()
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return False
+            self._pop()
+        items.append(item)
+        if item is not event:
+            self._latest[item] = event
+        self._ready.set()
+        return not full
+
+    async def put(self, event):
+        """Queue event, waiting for room if the policy is BLOCK. Dropped once the queue is closed."""
+        while self.policy == BLOCK and len(self._items) >= self.maxsize and not self.closed:
+            self._room.clear()
+            await self._room.wait()
+        if self.closed:
+            self.dropped += 1
+            return
+        self.put_nowait(event)
+
+    async def get_batch(self) -> list:
+        """Wait for events and return all queued events, oldest first."""
+        while not len(self._items) and not self.closed:
+            self._ready.clear()
+            await self._ready.wait()
+        return self.get_batch_nowait()
+
+    def get_batch_nowait(self, limit: int | None = None) -> list:
+        """Return up to limit (default: all) queued events, oldest first."""
+        n = len(self._items)
+        if limit is not None and limit < n:
+            n = limit
+        batch = [self._pop() for _ in range(n)]
+        if n:
+            self._room.set()
+        return batch
+
+    def close(self):
+        """Wake get_batch and put. Once the queue is drained get_batch returns empty batches."""
+        self.closed = True
+        self._ready.set()
+        self._room.set()
+
+    def _pop(self):
+        item = self._items.popleft()
+        return self._latest.pop(item) if type(item) is tuple else item
+
+
+class LaneQueue:
+    """
+    Priority lanes, each an EventQueue, with the same interface as EventQueue.
+
+    Topics are assigned to lanes by configuration (lane 0 is the most urgent); other
+    topics go to the last lane. A batch holds everything queued in the higher lanes
+    and at most `quota` events of the last lane. Urgent events thus never wait behind
+    more than `quota` queued telemetry events, while the last lane still makes progress
+    with every batch.
+    """
+
+    def __init__(self, lanes: dict, maxsize: int = 20, policy: str = DROP_NEWEST, coalesce=(), quota: int = 10):
+        """
+        Args:
+            lanes (dict): topic -> lane, e.g. {"?act": HIGH}.
+            maxsize, policy, coalesce: see EventQueue, apply to each lane.
+            quota (int): Maximum number of last lane events per batch.
+        """
+        self.lanes = lanes
+        self.quota = quota
+        n = max([LOW] + list(lanes.values())) + 1
+        self.queues = [EventQueue(maxsize, policy, coalesce) for _ in range(n)]
+        self._default = len(self.queues) - 1
+        self._ready = asyncio.Event()
+
+    @property
+    def dropped(self) -> int:
+        return sum(q.dropped for q in self.queues)
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues)
+
+    def _lane(self, event) -> EventQueue:
+        return self.queues[self.lanes.get(event.get("topic"), self._default)]
+
+    def put_nowait(self, event) -> bool:
+        """Queue event in its lane. Returns False if an event was dropped."""
+        res = self._lane(event).put_nowait(event)
+        self._ready.set()
+        return res
+
+    async def put(self, event):
+        """Queue event in its lane, waiting for room if the policy is BLOCK."""
+        await self._lane(event).put(event)
+        self._ready.set()
+
+    async def get_batch(self) -> list:
+        """Wait for events and return the next batch, most urgent lane first."""
+        while not len(self):
+            self._ready.clear()
+            await self._ready.wait()
+        batch = []
+        for q in self.queues[:-1]:
+            batch += q.get_batch_nowait()
+        return batch + self.queues[-1].get_batch_nowait(self.quota)
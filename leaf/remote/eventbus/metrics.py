@@ -0,0 +1,139 @@
+try:
+    from time import ticks_diff, ticks_us  # type: ignore
+except ImportError:
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+try:
+    bit_length = int.bit_length
+except AttributeError:
+    # MicroPython
+    def bit_length(n):
+        return len(bin(n)) - 2
+
+
+# latency histogram: bucket b counts calls taking < 2**b us
+BUCKETS = 28
+
+
+def handler_name(func) -> str:
+    name = getattr(func, "__qualname__", None) or getattr(func, "__name__", None) or repr(func)
+    module = getattr(func, "__module__", None)
+    return f"{module}.{name}" if module else name
+
+
+def _names(funcs) -> dict:
+    """Unique report key of each handler."""
+    names = {}
+    count = {}
+    for func in funcs:
+        if func not in names:
+            n = names[func] = handler_name(func)
+            count[n] = count.get(n, 0) + 1
+    for func, n in names.items():
+        if count[n] > 1:
+            names[func] = f"{n}@{id(func):x}"
+    return names
+
+
+class Metrics:
+    """
+    Bus instrumentation: per-topic emit counts, per-handler call counts and latency.
+
+    Latencies are recorded in power-of-two histograms, so recording is a few integer
+    operations and memory does not grow with the number of calls.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.topics = {}  # topic -> emit count
+        self.handlers = {}  # handler -> [calls, total_us, max_us, histogram]
+        self.failures = {}  # handler -> [errors, timeouts, breaker trips]
+        self.dispatch_us = 0  # total time spent calling handlers
+        self.max_queue_depth = 0  # largest emit_sync batch
+
+    def record_dispatch(self, topic, us: int):
+        self.topics[topic] = self.topics.get(topic, 0) + 1
+        self.dispatch_us += us
+
+    def record(self, func, us: int):
+        h = self.handlers.get(func)
+        if h is None:
+            h = self.handlers[func] = [0, 0, 0, [0] * BUCKETS]
+        h[0] += 1
+        h[1] += us
+        if us > h[2]:
+            h[2] = us
+        h[3][min(bit_length(us), BUCKETS - 1)] += 1
+
+    def record_failure(self, func, timeout: bool):
+        f = self.failures.get(func)
+        if f is None:
+            f = self.failures[func] = [0, 0, 0]
+        f[1 if timeout else 0] += 1
+
+    def record_trip(self, func):
+        f = self.failures.get(func)
+        if f is None:
+            f = self.failures[func] = [0, 0, 0]
+        f[2] += 1
+
+    def record_queue_depth(self, depth: int):
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    @staticmethod
+    def percentile(histogram: list, calls: int, p: float) -> float:
+        """Upper bound of the p-th percentile [ms]."""
+        n = 0
+        for b, count in enumerate(histogram):
+            n += count
+            if n >= p * calls:
+                return (1 << b) / 1000
+        return (1 << len(histogram)) / 1000
+
+    def report(self, bus=None) -> dict:
+        """
+        Metrics as a json serializable dict. Times in ms.
+
+        Handlers are reported by name; handlers sharing a name (e.g. lambdas, or the
+        methods of several instances) are told apart by an `@id` suffix.
+        """
+        open_circuits = [] if bus is None else list(bus.open_circuits)
+        name = _names(list(self.handlers) + list(self.failures) + open_circuits)
+        handlers = {}
+        for func, (calls, total, max_us, histogram) in self.handlers.items():
+            handlers[name[func]] = {
+                "calls": calls,
+                "total_ms": total / 1000,
+                "mean_ms": total / calls / 1000,
+                "p50_ms": self.percentile(histogram, calls, 0.5),
+                "p90_ms": self.percentile(histogram, calls, 0.9),
+                "p99_ms": self.percentile(histogram, calls, 0.99),
+                "max_ms": max_us / 1000,
+            }
+        failures = {
+            name[func]: {"errors": errors, "timeouts": timeouts, "trips": trips}
+            for func, (errors, timeouts, trips) in self.failures.items()
+        }
+        queue = None if bus is None else bus.event_queue
+        return {
+            "topics": self.topics,
+            "handlers": handlers,
+            "failures": failures,
+            "open_circuits": [name[func] for func in open_circuits],
+            "dispatch_ms": self.dispatch_us / 1000,
+            "sync_queue": {
+                "depth": 0 if queue is None else len(queue),
+                "max_depth": self.max_queue_depth,
+                "dropped": 0 if queue is None else queue.dropped,
+            },
+        }
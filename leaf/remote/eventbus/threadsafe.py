@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+from .event_queue import BLOCK, DROP_OLDEST
+
+
+class ThreadInbox:
+    """
+    Hands events from other threads to the event loop.
+
+    Threads append to a lock protected list. The loop is woken once per batch
+    (when the list goes from empty to non-empty), not once per event, and emits
+    the whole batch before it takes the next one.
+
+    The inbox holds at most `sync_queue_size` events. When full, the bus'
+    `thread_overflow` policy applies; with BLOCK (default) the producing thread
+    waits for room, so a fast producer is paced by the handlers.
+    """
+
+    def __init__(self, bus, loop):
+        self.bus = bus
+        self.loop = loop
+        self.dropped = 0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._drain_task())
+
+    def put(self, event):
+        """Queue event. Called from any thread other than the loop's."""
+        maxsize = self.bus.sync_queue_size
+        policy = self.bus.thread_overflow
+        with self._cond:
+            pending = self._pending
+            if len(pending) >= maxsize:
+                if policy == BLOCK:
+                    while len(self._pending) >= maxsize:
+                        self._cond.wait()
+                    pending = self._pending
+                else:
+                    self.dropped += 1
+                    if policy != DROP_OLDEST:
+                        return
+                    pending.pop(0)
+            pending.append(event)
+            wake = len(pending) == 1
+        if wake:
+            self.loop.call_soon_threadsafe(self._ready.set)
+
+    async def _drain_task(self):
+        bus = self.bus
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            with self._cond:
+                batch = self._pending
+                self._pending = []
+                self._cond.notify_all()
+            for event in batch:
+                await bus.emit(event)
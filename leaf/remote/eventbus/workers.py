@@ -0,0 +1,71 @@
+import asyncio
+import functools
+
+from .event_queue import BLOCK, EventQueue
+from .metrics import ticks_diff, ticks_us
+
+
+class KeyedWorkers:
+    """
+    Worker pool of a subscription made with `workers=N` (see `Bus.subscribe`).
+
+    Events are assigned to one of N workers by the value of `key` (e.g. the uid).
+    Events with the same key are handled one at a time, in order; events with
+    different keys are handled concurrently. emit only waits for room in the
+    worker's queue, not for the handler.
+    """
+
+    def __init__(self, bus, func, key: str, workers: int, as_event: bool, timeout: float | None, maxsize: int = 20):
+        self.bus = bus
+        self.func = func
+        self.key = key
+        self.as_event = as_event
+        self.timeout = timeout
+        self.queues = [EventQueue(maxsize, BLOCK) for _ in range(workers)]
+        self._tasks = None  # started on first event
+
+    async def put(self, event):
+        """Queue event with the worker for its key."""
+        if self._tasks is None:
+            self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+        queues = self.queues
+        await queues[hash(event.get(self.key)) % len(queues)].put(event)
+
+    def close(self):
+        """Stop the workers. Queued events are discarded, blocked puts return."""
+        for queue in self.queues:
+            queue.close()
+        if self._tasks is not None:
+            for task in self._tasks:
+                task.cancel()
+            self._tasks = None
+
+    async def _worker(self, queue: EventQueue):
+        bus = self.bus
+        func = self.func
+        as_event = self.as_event
+        timeout = bus.handler_timeout if self.timeout is None else self.timeout
+        while True:
+            for event in await queue.get_batch():
+                kwargs = event if as_event or type(event) is dict else event.as_dict()
+                t0 = ticks_us()
+                if await bus._invoke(func, False, as_event, timeout, event, kwargs) and bus.metrics is not None:
+                    bus.metrics.record(func, ticks_diff(ticks_us(), t0))
+
+
+def in_executor(bus, func, executor):
+    """
+    Wrap handler func to run in an executor (see `Bus.subscribe(..., executor=)`). CPython only.
+
+    The wrapper awaits the result on the event loop; a returned dict (or Event) is
+    emitted. With a process pool, func and the events must be picklable.
+    """
+
+    @functools.wraps(func)
+    async def offloaded(*args, **kwargs):
+        pool = bus._executor(executor)
+        res = await asyncio.get_event_loop().run_in_executor(pool, functools.partial(func, *args, **kwargs))
+        if res is not None:
+            await bus.emit(res)
+
+    return offloaded
@@ -1,4 +1,4 @@
-from eventbus import bus
+from eventbus import bus, correlate
 
 
 class Discover:
@@ -12,15 +12,15 @@ class Discover:
             self._discoveries[id] = message
 
         @bus.on("?discover")
-        async def get(topic, src, dst, uid=None):
+        async def get(topic, src, dst, uid=None, rid=None):
             if uid is None:
                 # copy keys to protect against modification in !state by a different task
                 for uid in list(self._discoveries.keys()):
                     value, ts = self._discoveries[uid]
-                    await bus.emit(topic="!state", uid=uid, value=value, timestamp=ts, dst=src)
+                    await bus.emit(topic="!state", uid=uid, value=value, timestamp=ts, dst=src, **correlate(rid))
             else:
                 if uid in self._discoveries:
                     value, ts = self._discoveries[uid]
-                    await bus.emit(topic="!state", uid=uid, value=value, timestamp=ts, dst=src)
+                    await bus.emit(topic="!state", uid=uid, value=value, timestamp=ts, dst=src, **correlate(rid))
                 else:
-                    await bus.emit(topic="#state", uid=uid, error="state not known", dst=src)
+                    await bus.emit(topic="#state", uid=uid, error="state not known", dst=src, **correlate(rid))
@@ -4,7 +4,7 @@ import logging
 import time
 from collections import deque
 
-from eventbus import bus
+from eventbus import bus, correlate
 
 BLUE = "\x1b[38;5;4m"
 GREEN = "\x1b[38;5;2m"
@@ -33,6 +33,8 @@ class Log:
                     return
             levelno = event.get("levelno", 0)
             if levelno >= logging.ERROR:
+                # e.g. replies to ?log: the correlation id belongs to that query only
+                event.pop("rid", None)
                 self.history.appendleft(event)  # type: ignore
             colors = {
                 logging.DEBUG: BLUE,
@@ -55,7 +57,7 @@ class Log:
                 print(tb)
 
         @bus.on("?log")
-        async def get_log(src, **event):
+        async def get_log(src, rid=None, **event):
             # TODO: should send out !log ???
             # send logging history
             history = self.history
@@ -64,9 +66,8 @@ class Log:
                 # MicroPython does not implement iterating over deque
                 ev = history.popleft()
                 history.append(ev)
-                # retarget event to requester
-                ev["dst"] = dst
-                await bus.emit(ev)
+                # retarget a copy to the requester, rid must not stick to the history entry
+                await bus.emit(dict(ev, dst=dst), **correlate(rid))
 
 
 def init():
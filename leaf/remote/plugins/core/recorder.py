@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import time
+
+from eventbus import Metrics, bus
+
+
+class Recorder:
+    """
+    Record bus traffic to a file, e.g. to replay it later for load tests.
+
+    Each line holds `[time, event]` as json. When the file exceeds max_bytes it is
+    renamed to path.1 (path.1 to path.2, ...), keeping at most `backups` old files.
+
+    Events are received through a bus stream, so writing the file never stalls emit;
+    if the recorder falls behind, the oldest unwritten events are dropped.
+
+    Example:
+        recorder = Recorder("/recording.jsonl", topics=("!state", "?act"))
+    """
+
+    def __init__(self, path="recording.jsonl", topics=("*",), max_bytes=100_000, backups=2, maxsize=100, source=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.recorded = 0
+        self.skipped = 0  # events that are not json serializable
+        self.source = bus if source is None else source
+        self.stream = self.source.stream(*topics, maxsize=maxsize)
+        self._file = None
+        self._size = 0
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def dropped(self) -> int:
+        return self.stream.dropped
+
+    def close(self):
+        """Stop recording. The file is closed once the buffered events are written."""
+        self.stream.close()
+
+    async def _run(self):
+        self._open()
+        try:
+            async for event in self.stream:
+                self.write(event)
+                if not len(self.stream.queue):
+                    # caught up
+                    self._file.flush()  # type: ignore
+        finally:
+            self._file.close()  # type: ignore
+
+    def write(self, event, timestamp=None):
+        try:
+            line = json.dumps(
+                [
+                    round(self.source.clock.time() if timestamp is None else timestamp, 3),
+                    event if type(event) is dict else event.as_dict(),
+                ]
+            )
+        except (TypeError, ValueError):
+            self.skipped += 1
+            return
+        line += "\n"
+        if self._size and self._size + len(line) > self.max_bytes:
+            self._rotate()
+        self._file.write(line)  # type: ignore
+        self._size += len(line)
+        self.recorded += 1
+
+    def _open(self):
+        try:
+            self._size = os.stat(self.path)[6]
+        except OSError:
+            self._size = 0
+        self._file = open(self.path, "a")
+
+    def _rotate(self):
+        self._file.close()  # type: ignore
+        names = [self.path] + [f"{self.path}.{i}" for i in range(1, self.backups + 1)]
+        _remove(names[-1])
+        for i in range(len(names) - 1, 0, -1):
+            try:
+                os.rename(names[i - 1], names[i])
+            except OSError:
+                pass
+        self._open()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def read_recording(*paths):
+    """Yield (time, event) from recordings, e.g. read_recording("rec.jsonl.1", "rec.jsonl")."""
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    t, event = json.loads(line)
+                    yield t, event
+
+
+async def replay(*paths, speed: float | None = 1, target=None) -> dict:
+    """
+    Emit recorded events.
+
+    Args:
+        *paths: Recording files, oldest first.
+        speed (float): 1 replays with the original timing, 10 ten times faster,
+            None as fast as possible.
+        target (Bus): Bus to emit to, default: bus.
+
+    Returns:
+        Metrics report of the replay (handler latencies etc.), plus the number of
+        `events`, `seconds` and achieved `events_per_sec`.
+    """
+    target = bus if target is None else target
+    metrics = target.metrics
+    target.metrics = Metrics()
+    try:
+        start = time.time()
+        t0 = None
+        n = 0
+        for t, event in read_recording(*paths):
+            if speed:
+                if t0 is None:
+                    t0 = t
+                delay = (t - t0) / speed - (time.time() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await target.emit(event)
+            n += 1
+        seconds = time.time() - start
+        report = target.metrics.report(target)
+    finally:
+        target.metrics = metrics
+    report["events"] = n
+    report["seconds"] = seconds
+    report["events_per_sec"] = n / seconds if seconds else 0
+    return report
+
+
+def init(**param):
+    return Recorder(**param)
@@ -1,4 +1,4 @@
-from eventbus import bus
+from eventbus import bus, correlate
 
 
 class SensorState:
@@ -8,20 +8,20 @@ class SensorState:
         self._state = {}
 
         @bus.on("!state")
-        def update(topic, src, dst, uid, value, timestamp):
+        def update(topic, src, dst, uid, value, timestamp, rid=None):
             # TODO: ignore !state send in respone to !state (below)
             self._state[uid] = (value, timestamp)
 
         @bus.on("?state")
-        async def get(topic, src, dst, uid=None):
+        async def get(topic, src, dst, uid=None, rid=None):
             if uid is None:
                 # copy keys to protect against modification in !state by a different task
                 for uid in list(self._state.keys()):
                     value, ts = self._state[uid]
-                    await bus.emit(topic="!state", uid=uid, value=value, timestamp=ts, dst=src)
+                    await bus.emit(topic="!state", uid=uid, value=value, timestamp=ts, dst=src, **correlate(rid))
             else:
                 if uid in self._state:
                     value, ts = self._state[uid]
-                    await bus.emit(topic="!state", uid=uid, value=value, timestamp=ts, dst=src)
+                    await bus.emit(topic="!state", uid=uid, value=value, timestamp=ts, dst=src, **correlate(rid))
                 else:
-                    await bus.emit(topic="#state", uid=uid, error="state not known", dst=src)
+                    await bus.emit(topic="#state", uid=uid, error="state not known", dst=src, **correlate(rid))
@@ -0,0 +1,451 @@
+import asyncio
+import json
+
+import pytest
+from eventbus import bus, create_bus
+from eventbus.clock import VirtualClock
+from eventbus.devices import Device, State
+from eventbus.event_net import Bridge, Transport, codec
+from eventbus.event_net.codec import JSON, MSGPACK
+
+
+class MemoryTransport(Transport):
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def receive(self):
+        # silent peer
+        await asyncio.Event().wait()
+
+
+@pytest.fixture
+async def bridge():
+    bridge = Bridge("peer", MemoryTransport())
+    yield bridge
+    bridge.abort()
+
+
+def sent_events(bridge):
+    return [json.loads(line) for msg in bridge.transport.sent for line in msg.split("\n")[:-1]]
+
+
+async def test_emit_flush(bridge):
+    await bridge.emit({"topic": "!state", "uid": "a", "value": 1})
+    await bridge.emit({"topic": "!log", "message": "hi"})
+    assert bridge.transport.sent == []
+    await bridge.flush()
+    assert sent_events(bridge) == [{"topic": "!state", "uid": "a", "value": 1}, {"topic": "!log", "message": "hi"}]
+    await bridge.flush()
+    assert len(bridge.transport.sent) == 1
+
+
+async def test_coalesce(bridge):
+    bridge.coalesce = {"!state"}
+    for value in range(3):
+        await bridge.emit({"topic": "!state", "uid": "a", "value": value})
+        await bridge.emit({"topic": "!state", "uid": "b", "value": value})
+    await bridge.emit({"topic": "!log", "message": "hi"})
+    await bridge.flush()
+    assert sent_events(bridge) == [
+        {"topic": "!state", "uid": "a", "value": 2},
+        {"topic": "!state", "uid": "b", "value": 2},
+        {"topic": "!log", "message": "hi"},
+    ]
+
+
+async def test_routing(bridge):
+    other = Bridge("other", MemoryTransport())
+    try:
+        bridge.dst_filter = {"peer", "#clients"}
+        await bus.emit(topic="!state", uid="a", value=1, dst="#clients")
+        await bus.emit(topic="!state", uid="b", value=2, dst="other")
+        await bus.emit(topic="!state", uid="c", value=3, dst="nobody")
+        assert [e["uid"] for e in sent_events(bridge)] == ["a"]
+        assert [e["uid"] for e in sent_events(other)] == ["b"]
+
+        # closed bridges are removed from the routing table
+        other._closed = True
+        await bus.emit(topic="!state", uid="d", value=4, dst="other")
+        await bus.emit(topic="!state", uid="e", value=5, dst="other")
+        assert [e["uid"] for e in sent_events(other)] == ["b"]
+        assert "other" not in bus._routes
+    finally:
+        other.abort()
+
+
+async def test_virtual_time():
+    clock = VirtualClock()
+    real_clock = bus.clock
+    bus.clock = clock
+    bridge = Bridge("peer", MemoryTransport())
+    try:
+        await bridge.emit({"topic": "!state", "uid": "a", "value": 1})
+        await clock.advance(bridge.max_latency / 2)
+        assert bridge.transport.sent == []
+        await clock.advance(bridge.max_latency / 2)
+        assert len(sent_events(bridge)) == 1
+
+        # silent peer: ?echo after receive_timeout, closed after another
+        run = asyncio.create_task(bridge.run())
+        await clock.advance(bridge.receive_timeout)
+        assert sent_events(bridge)[-1]["topic"] == "?echo"
+        assert not run.done()
+        await clock.advance(bridge.receive_timeout)
+        await run
+        assert bridge._closed
+        assert clock.time() == bridge.max_latency + 2 * bridge.receive_timeout
+    finally:
+        bus.clock = real_clock
+        bridge.abort()
+
+
+class BrokenTransport(MemoryTransport):
+    async def receive(self):
+        raise ConnectionError()
+
+
+async def test_connection_lost():
+    bridge = Bridge("peer", BrokenTransport())
+    await asyncio.sleep(0)  # flush task waiting for events
+    await bridge.run()
+    await asyncio.sleep(0)
+    # no task or route left behind
+    assert bridge._closed
+    assert bridge._flush_task.done()
+    assert "peer" not in bus._routes
+
+    # not kept alive by the flush task
+    other = Bridge("other", MemoryTransport())
+    await asyncio.sleep(0)
+    other._flush_task.cancel()
+    await asyncio.sleep(0)
+    assert other._flush_task.done()
+    other.abort()
+
+
+class PipeTransport(Transport):
+    def __init__(self):
+        self.inbox = asyncio.Queue()
+        self.peer = None
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+        self.peer.inbox.put_nowait(message)
+
+    async def receive(self):
+        return await self.inbox.get()
+
+
+async def test_isolated_leaves():
+    leaves = [create_bus(f"leaf{i}") for i in range(3)]
+    server = create_bus("server")
+    bridges = []
+    for leaf in leaves:
+        Device("dev", State("voltage"), bus=leaf)
+        t_leaf, t_server = PipeTransport(), PipeTransport()
+        t_leaf.peer, t_server.peer = t_server, t_leaf
+        bridges += [Bridge("server", t_leaf, bus=leaf), Bridge(leaf.LEAF_ID, t_server, bus=server)]
+    tasks = [asyncio.create_task(bridge.run()) for bridge in bridges]
+    try:
+        responses = await asyncio.gather(*[server.request("?device", dst=leaf.LEAF_ID, timeout=1) for leaf in leaves])
+        assert [r["uid"] for r in responses] == ["leaf0.dev", "leaf1.dev", "leaf2.dev"]
+        assert [r["src"] for r in responses] == ["leaf0", "leaf1", "leaf2"]
+        assert list(leaves[1].devices) == ["leaf1.dev"]
+        assert "leaf1.dev" not in Device._registry
+        assert bus.LEAF_ID != "leaf1"
+    finally:
+        for bridge in bridges:
+            bridge.abort()
+        for task in tasks:
+            task.cancel()
+
+
+async def test_codec_negotiation():
+    # peer without binary support, and peer with the default codecs
+    for codecs, expected in (((JSON,), JSON), (codec.CODECS, MSGPACK)):
+        a, b = create_bus("a"), create_bus("b")
+        t_a, t_b = PipeTransport(), PipeTransport()
+        t_a.peer, t_b.peer = t_b, t_a
+        bridge_a, bridge_b = Bridge("b", t_a, bus=a), Bridge("a", t_b, bus=b)
+        bridge_b.codecs = codecs
+        bridge_a.compressions = bridge_b.compressions = ()
+        received = []
+        b.subscribe(lambda **event: received.append(event), "!state")
+        tasks = [asyncio.create_task(bridge.run()) for bridge in (bridge_a, bridge_b)]
+        try:
+            event = {"topic": "!state", "uid": "a.dev.v", "value": -1.5, "timestamp": 1, "dst": "b"}
+            await a.request("?echo", dst="b", timeout=1)
+            assert bridge_a.codec == bridge_b.codec == expected
+            await a.emit(dict(event))
+            await a.request("?echo", dst="b", timeout=1)
+            assert received == [dict(event, src="a")]
+            assert type(t_a.sent[-1]) is type(t_b.sent[-1]) is (str if expected == JSON else bytes)
+        finally:
+            for bridge in (bridge_a, bridge_b):
+                bridge.abort()
+            for task in tasks:
+                task.cancel()
+
+
+async def test_batching():
+    clock = VirtualClock()
+    a = create_bus("a", clock=clock)
+    t_a, t_b = PipeTransport(), PipeTransport()
+    t_a.peer = t_b
+    bridge = Bridge("b", t_a, bus=a)
+    bridge.compressions = ()
+    run = asyncio.create_task(bridge.run())
+    try:
+        await clock.advance(0)
+        assert [e["topic"] for e in codec.decode(t_b.inbox.get_nowait())] == ["!wire"]
+
+        # isolated event sent at once, a burst is batched
+        for i in range(4):
+            await a.emit(topic="!state", uid="a.dev.v", value=i, dst="b")
+        assert len(t_a.sent) == 2
+        await clock.advance(bridge.max_latency - 0.01)
+        assert len(t_a.sent) == 2
+        await clock.advance(0.01)
+        assert [e["value"] for e in codec.decode(t_a.sent[-1])] == [1, 2, 3]
+
+        # rid=None is not a response
+        n = len(t_a.sent)
+        for i in range(4):
+            await a.emit(topic="!state", uid="a.dev.v", value=i, rid=None, dst="b")
+        assert len(t_a.sent) == n
+        await bridge.flush()
+
+        # requests flush queued events (urgent ones go first)
+        await a.emit(topic="!state", uid="a.dev.v", value=4, dst="b")
+        await a.emit(topic="?act", uid="a.dev.v", rid="a:x", dst="b")
+        assert [e["topic"] for e in codec.decode(t_a.sent[-1])] == ["?act", "!state"]
+
+        # the latency budget follows the round trip time
+        await clock.advance(0.1)
+        t_a.inbox.put_nowait(codec.encode(JSON, {"topic": "!act", "rid": "a:x", "src": "b", "dst": "a"}))
+        await clock.advance(0)
+        assert bridge.rtt == pytest.approx(0.1)
+        assert bridge.latency == pytest.approx(0.1 * bridge.rtt_factor)
+        n = len(t_a.sent)
+        for i in range(20):
+            await a.emit(topic="!state", uid="a.dev.v", value=i, dst="b")
+        assert len(t_a.sent) - n < 5  # the first ones after the pause may be sent at once
+        await clock.advance(bridge.latency)
+        assert sum(len(codec.decode(frame)) for frame in t_a.sent[n:]) == 20
+    finally:
+        bridge.abort()
+        run.cancel()
+
+
+async def test_urgent():
+    a, b = create_bus("a"), create_bus("b")
+    t_a, t_b = PipeTransport(), PipeTransport()
+    t_a.peer, t_b.peer = t_b, t_a
+    bridge_a, bridge_b = Bridge("b", t_a, bus=a), Bridge("a", t_b, bus=b)
+    handled = []
+    b.subscribe(lambda topic, **event: handled.append(topic), "!state", "?act")
+    run = asyncio.create_task(bridge_b.run())
+    try:
+        # sent ahead of queued telemetry
+        for i in range(5):
+            await bridge_a.emit({"topic": "!state", "uid": "u", "value": i})
+        await bridge_a.emit({"topic": "?act", "uid": "u", "value": 1})
+        await bridge_a.flush()
+        assert codec.decode(t_a.sent[-1])[0]["topic"] == "?act"
+        # dispatched ahead of the telemetry of the same frame
+        t_b.inbox.put_nowait("".join(codec.encode(JSON, {"topic": topic}) for topic in ("!state", "!state", "?act")))
+        await asyncio.sleep(0.01)
+        assert handled[-3:] == ["?act", "!state", "!state"]
+    finally:
+        for bridge in (bridge_a, bridge_b):
+            bridge.abort()
+        run.cancel()
+
+
+async def test_compression():
+    a, b = create_bus("a"), create_bus("b")
+    t_a, t_b = PipeTransport(), PipeTransport()
+    t_a.peer, t_b.peer = t_b, t_a
+    bridge_a, bridge_b = Bridge("b", t_a, bus=a), Bridge("a", t_b, bus=b)
+    bridge_a.codecs = (JSON,)
+    received = []
+    b.subscribe(lambda **event: received.append(event), "!state")
+    tasks = [asyncio.create_task(bridge.run()) for bridge in (bridge_a, bridge_b)]
+    try:
+        await a.request("?echo", dst="b", timeout=1)
+        assert bridge_a.compression == bridge_b.compression == codec.DEFLATE
+        events = [{"topic": "!state", "uid": "a.dev.v", "value": i, "timestamp": i, "dst": "b"} for i in range(10)]
+        sizes = []
+        for event in events:
+            await a.emit(dict(event))
+            await bridge_a.flush()
+            sizes.append(len(t_a.sent[-1]))
+        await a.request("?echo", dst="b", timeout=1)
+        assert received == [dict(event, src="a") for event in events]
+        # context persists across frames: repeated strings cost little after the first frame
+        assert sizes[-1] < sizes[0] / 2
+        assert sizes[-1] < len(codec.encode(bridge_b.codec, dict(events[-1], src="a"))) / 2
+    finally:
+        for bridge in (bridge_a, bridge_b):
+            bridge.abort()
+        for task in tasks:
+            task.cancel()
+
+
+async def test_interning():
+    a, b = create_bus("a"), create_bus("b")
+    event = {"topic": "!state", "uid": "a.victron.battery_voltage", "value": 12.84, "timestamp": 1.5, "dst": "b"}
+    plain = len(codec.encode(MSGPACK, dict(event, src="a")))
+    Bridge._symbol_tables.pop(("a", "b"), None)
+    for connection in range(2):
+        t_a, t_b = PipeTransport(), PipeTransport()
+        t_a.peer, t_b.peer = t_b, t_a
+        bridge_a, bridge_b = Bridge("b", t_a, bus=a), Bridge("a", t_b, bus=b)
+        bridge_a.compressions = ()
+        received = []
+        sub = b.subscribe(lambda **event: received.append(event), "!state")
+        tasks = [asyncio.create_task(bridge.run()) for bridge in (bridge_a, bridge_b)]
+        try:
+            await a.request("?echo", dst="b", timeout=1)
+            # new connection: table resent (resync), same ids
+            assert bridge_a._encoder.symbols is Bridge._symbol_tables[("a", "b")]
+            sizes = []
+            for value in range(3):
+                await a.emit(dict(event, value=value + 0.5))
+                await bridge_a.flush()
+                sizes.append(len(t_a.sent[-1]))
+            await a.request("?echo", dst="b", timeout=1)
+            assert received == [dict(event, value=value + 0.5, src="a") for value in range(3)]
+            assert sizes[1] == sizes[2] < plain / 3
+            assert sizes[0] > sizes[1]  # symbol definitions
+        finally:
+            sub.cancel()
+            for bridge in (bridge_a, bridge_b):
+                bridge.abort()
+            for task in tasks:
+                task.cancel()
+
+    # table full: strings sent as is
+    encoder, decoder = codec.FrameEncoder(JSON, symbols=codec.SymbolTable(size=2)), codec.FrameDecoder()
+    events = [{"topic": "t", "uid": f"u{i}", "dst": None, "n": i} for i in range(3)]
+    assert decoder.decode(encoder.frame([encoder.event(e) for e in events])) == events
+
+
+async def test_symbol_tables_bounded():
+    a = create_bus("a")
+    tables = Bridge._symbol_tables
+    tables.clear()
+    for peer in ("p0", "p1", "p0", "p2", "p3"):
+        bridge = Bridge(peer, MemoryTransport(), bus=a)
+        bridge.symbol_peers = 2
+        await bridge._negotiate({"symbols": True})
+        bridge.abort()
+    # least recently connected are dropped
+    assert list(tables) == [("a", "p2"), ("a", "p3")]
+    tables.clear()
+
+
+async def test_delta():
+    a, b = create_bus("a"), create_bus("b")
+    t_a, t_b = PipeTransport(), PipeTransport()
+    t_a.peer, t_b.peer = t_b, t_a
+    bridge_a, bridge_b = Bridge("b", t_a, bus=a), Bridge("a", t_b, bus=b)
+    bridge_a.compressions = ()
+    bridge_a.delta = bridge_b.delta = 4
+    bridge_a.coalesce = ("!state",)
+    received = []
+    b.subscribe(lambda **event: received.append(event), "!state")
+    tasks = [asyncio.create_task(bridge.run()) for bridge in (bridge_a, bridge_b)]
+    try:
+        await a.request("?echo", dst="b", timeout=1)
+        sent = []
+        sizes = []
+        for i in range(10):
+            event = {"topic": "!state", "uid": "a.ina.current", "value": 0.25 + i / 100, "timestamp": 100 + i * 0.5}
+            sent.append(dict(event, dst="b", src="a"))
+            await a.emit(dict(event, dst="b"))
+            await bridge_a.flush()
+            sizes.append(len(t_a.sent[-1]))
+        # ints, values without exact decimals and coalesced updates
+        for value in (3, 4, 1 / 3, "on", 0.5, 0.75):
+            await bridge_a.emit({"topic": "!state", "uid": "u", "value": value, "timestamp": 1.001, "src": "a"})
+        await bridge_a.flush()
+        await a.request("?echo", dst="b", timeout=1)
+        assert received == sent + [{"topic": "!state", "uid": "u", "value": 0.75, "timestamp": 1.001, "src": "a"}]
+        # keyframes every 4 events
+        assert sizes[0] > sizes[1] == sizes[2] == sizes[3] < sizes[4]
+        assert sizes[4] == sizes[8]
+    finally:
+        for bridge in (bridge_a, bridge_b):
+            bridge.abort()
+        for task in tasks:
+            task.cancel()
+
+
+class GatedTransport(MemoryTransport):
+    """send waits until the gate opens."""
+
+    def __init__(self):
+        super().__init__()
+        self.gate = asyncio.Event()
+
+    async def send(self, message):
+        await self.gate.wait()
+        self.sent.append(message)
+
+
+async def test_negotiate_while_sending():
+    a = create_bus("a")
+    bridge = Bridge("b", GatedTransport(), bus=a)
+    bridge.compressions = ()
+    try:
+        await bridge.emit({"topic": "!state", "uid": "u", "value": 1})
+        negotiate = asyncio.create_task(bridge._negotiate({"codecs": [MSGPACK], "symbols": False}))
+        await asyncio.sleep(0)
+        # queued while the JSON frame is being sent
+        await bridge.emit({"topic": "!state", "uid": "u", "value": 2})
+        bridge.transport.gate.set()
+        await negotiate
+        await bridge.flush()
+        assert [type(frame) for frame in bridge.transport.sent] == [str, bytes]
+        assert [e["value"] for frame in bridge.transport.sent for e in codec.decode(frame)] == [1, 2]
+    finally:
+        bridge.abort()
+
+
+def test_delta_encoding_failures():
+    encoder, decoder = codec.FrameEncoder(MSGPACK, delta=10), codec.FrameDecoder()
+
+    def state(value, **extra):
+        return {"topic": "!state", "uid": "u", "value": value, "timestamp": 1, **extra}
+
+    assert decoder.decode(encoder.frame([encoder.event(state(1.25))]))[0]["value"] == 1.25
+    pieces = [encoder.event(state(4.0))]
+    # events that fail to encode are not sent and leave the bases alone
+    with pytest.raises(TypeError):
+        encoder.event(state(5.25, bad=object()))
+    assert decoder.decode(encoder.frame(pieces))[0]["value"] == 4.0
+    # scaled values beyond 64 bit are sent as is
+    for value in (6.0, 1e300, -1e300, 2.5, 3, -(2**62), 2**62, 3):
+        assert decoder.decode(encoder.frame([encoder.event(state(value))]))[0]["value"] == value
+    # events without delta codes leave the bases alone, also when in the same frame as a delta
+    encoder, decoder = codec.FrameEncoder(MSGPACK, delta=10), codec.FrameDecoder()
+    for values in ([1.5], [1.6, None], [1.7], [1.8, "on"], [1.9], [None, 2.0], [2.1]):
+        frame = encoder.frame([encoder.event({"topic": "!state", "uid": "u", "value": value}) for value in values])
+        events = decoder.decode(frame)
+        assert [event["value"] for event in events] == values
+
+
+def test_msgpack():
+    values = [None, True, False, 0, 127, 128, -32, -33, 2**40, -(2**40), 1.5, "", "x" * 40, "é" * 300, b"\x00"]
+    values += [list(range(20)), {"k": {"n": [1, None]}}, {str(i): i for i in range(20)}]
+    for value in values:
+        assert codec.unpackb(codec.packb(value)) == value
+    events = [{"topic": "!state", "uid": "u", "value": i} for i in range(3)]
+    assert codec.decode(b"".join(codec.encode(MSGPACK, e) for e in events)) == events
+    assert codec.decode("".join(codec.encode(JSON, e) for e in events)) == events
+    assert codec.packb({"a": 1}) == b"\x81\xa1a\x01"
@@ -1,6 +1,13 @@
 import asyncio
+import time
 
-from eventbus import bus
+import pytest
+from eventbus import bus, create_bus
+from eventbus.clock import VirtualClock
+from eventbus.ev_bus import Bus
+from eventbus.event import Event
+from eventbus.event_queue import BLOCK, DROP_OLDEST, HIGH, EventQueue, QueueFull
+from eventbus.metrics import Metrics
 
 
 async def test_events():
@@ -82,6 +89,586 @@ async def test_listen():
     assert N == 2
 
 
+async def test_dispatch_plan():
+    b = Bus()
+    calls = []
+
+    def cb_sync(topic, **event):
+        calls.append(("sync", topic))
+
+    async def cb_async(topic, **event):
+        calls.append(("async", topic))
+
+    def cb_returns_awaitable(topic, **event):
+        return cb_async(topic=topic)
+
+    b.subscribe(cb_sync, "topic1")
+    b.subscribe(cb_async, "*")
+    await b.emit(topic="topic1")
+    assert calls == [("sync", "topic1"), ("async", "topic1")]
+    assert b._plans["topic1"] == ((cb_sync, False, False, None), (cb_async, True, False, None))
+
+    # plans are rebuilt when subscriptions change
+    calls.clear()
+    b.subscribe(cb_returns_awaitable, "topic1")
+    await b.emit(topic="topic1")
+    assert calls == [("sync", "topic1"), ("async", "topic1"), ("async", "topic1")]
+
+    calls.clear()
+    b.unsubscribe(cb_async, "*")
+    b.unsubscribe(cb_returns_awaitable, "topic1")
+    await b.emit(topic="topic1")
+    assert calls == [("sync", "topic1")]
+
+
+async def test_patterns():
+    b = Bus()
+    calls = []
+
+    def cb(name):
+        def _cb(topic, **event):
+            calls.append((name, topic))
+
+        return _cb
+
+    b.subscribe(cb("queries"), "?*")
+    b.subscribe(cb("leaf1"), "!state/leaf1/*")
+    b.subscribe(cb("state"), "!state*")
+    b.subscribe(cb("exact"), "!state/leaf1/voltage")
+    b.subscribe(cb("none"), "!")
+
+    await b.emit(topic="?config")
+    await b.emit(topic="!state/leaf1/voltage")
+    await b.emit(topic="!state/leaf2/voltage")
+    await b.emit(topic="!log")
+    assert calls == [
+        ("queries", "?config"),
+        ("exact", "!state/leaf1/voltage"),
+        ("state", "!state/leaf1/voltage"),
+        ("leaf1", "!state/leaf1/voltage"),
+        ("state", "!state/leaf2/voltage"),
+        ("none", "!log"),
+    ]
+
+
+async def test_concurrent_dispatch():
+    b = Bus(concurrency=2)
+    seen = {"slow1": [], "slow2": [], "fail": []}
+
+    async def slow1(topic, seq, **event):
+        await asyncio.sleep(0.02)
+        seen["slow1"].append(seq)
+
+    async def slow2(topic, seq, **event):
+        await asyncio.sleep(0.02)
+        seen["slow2"].append(seq)
+
+    async def fail(topic, seq, **event):
+        seen["fail"].append(seq)
+        raise RuntimeError("handler failed")
+
+    b.subscribe(slow1, "topic")
+    b.subscribe(fail, "topic")
+    b.subscribe(slow2, "topic")
+    loop = asyncio.get_event_loop()
+    t0 = loop.time()
+    for seq in range(3):
+        await b.emit(topic="topic", seq=seq)
+    # slow handlers overlap: ~3 x 20ms rather than 3 x 40ms
+    assert loop.time() - t0 < 0.1
+    assert seen == {"slow1": [0, 1, 2], "slow2": [0, 1, 2], "fail": [0, 1, 2]}
+
+
+async def test_emit_sync_batch():
+    b = Bus(sync_queue_size=100)
+    seqs = []
+    b.subscribe(lambda seq, **event: seqs.append(seq), "topic")
+    for seq in range(100):
+        b.emit_sync(topic="topic", seq=seq)
+    b.emit_sync(topic="topic", seq=100)
+    await asyncio.sleep(0.001)
+    # the whole batch is delivered at once, the overflow is dropped
+    assert seqs == list(range(100))
+    assert b.dropped == 1
+
+
+async def test_event_queue_overflow():
+    q = EventQueue(2, DROP_OLDEST)
+    for i in range(4):
+        q.put_nowait(i)
+    assert await q.get_batch() == [2, 3]
+    assert q.dropped == 2
+
+    q = EventQueue(1, BLOCK)
+    q.put_nowait(0)
+    with pytest.raises(QueueFull):
+        q.put_nowait(1)
+    put = asyncio.create_task(q.put(1))
+    await asyncio.sleep(0)
+    assert not put.done()
+    assert await q.get_batch() == [0]
+    await put
+    assert await q.get_batch() == [1]
+    assert q.dropped == 0
+
+
+async def test_emit_sync_coalesce():
+    b = Bus(coalesce=("!state",))
+    seen = []
+    b.subscribe(lambda uid, value, **event: seen.append((uid, value)), "!state")
+    for value in range(3):
+        b.emit_sync(topic="!state", uid="a", value=value)
+        b.emit_sync(topic="!state", uid="b", value=value)
+    b.emit_sync(topic="!log", uid="a", value=0)
+    assert len(b.event_queue) == 3  # type: ignore
+    await asyncio.sleep(0.001)
+    # latest value per uid, in order of first arrival
+    assert seen == [("a", 2), ("b", 2)]
+    assert b.dropped == 0
+
+
+async def test_metrics():
+    b = Bus(metrics=True)
+
+    def cb_sync(**event):
+        pass
+
+    async def cb_async(**event):
+        await asyncio.sleep(0.002)
+
+    b.subscribe(cb_sync, "topic1")
+    b.subscribe(cb_async, "topic1", "topic2")
+    for _ in range(3):
+        await b.emit(topic="topic1")
+    await b.emit(topic="topic2")
+    b.emit_sync(topic="topic2")
+    b.emit_sync(topic="topic2")
+    await asyncio.sleep(0.01)
+
+    report = b.metrics.report(b)  # type: ignore
+    assert report["topics"] == {"topic1": 3, "topic2": 3}
+    handlers = {name.rsplit(".", 1)[-1]: h for name, h in report["handlers"].items()}
+    assert handlers["cb_sync"]["calls"] == 3
+    assert handlers["cb_async"]["calls"] == 6
+    assert 2 <= handlers["cb_async"]["p50_ms"] <= handlers["cb_async"]["p99_ms"]
+    assert report["dispatch_ms"] >= 6 * 2
+    assert report["sync_queue"] == {"depth": 0, "max_depth": 2, "dropped": 0}
+
+    # handlers sharing a name are reported separately
+    b = Bus(metrics=True)
+    for _ in range(2):
+        b.subscribe(lambda **event: None, "topic")
+    await b.emit(topic="topic")
+    handlers = b.metrics.report(b)["handlers"]  # type: ignore
+    assert len(handlers) == 2
+    assert all("<lambda>@" in name for name in handlers)
+
+
+async def test_metrics_event():
+    import eventbus.metrics as m
+
+    assert m.Metrics is Metrics  # not hidden by the ?metrics responder
+    b = create_bus("leaf1", metrics=True)
+    await b.emit(topic="topic")
+    event = await b.request("?metrics", dst="leaf1", timeout=1)
+    assert event["topic"] == "!metrics"
+    assert event["dst"] == "leaf1"
+    assert event["metrics"]["topics"]["topic"] == 1
+
+
+def test_event():
+    event = Event("!state", uid="a", value=None, unit="V")
+    assert event.topic == "!state"
+    assert event["value"] is None and "value" in event
+    assert "src" not in event and event.get("src", "x") == "x"
+    event.update({"src": "leaf1", "note": "n"})
+    assert event.as_dict() == {"topic": "!state", "src": "leaf1", "uid": "a", "value": None, "unit": "V", "note": "n"}
+    assert event == Event.from_dict(event.as_dict())
+    with pytest.raises(KeyError):
+        event["dst"]
+
+
+async def test_as_event():
+    b = Bus()
+    b.LEAF_ID = "leaf1"
+    seen = []
+
+    def kwargs_handler(topic, uid, value, src):
+        seen.append(("kwargs", uid, value, src))
+
+    @b.on("!state", as_event=True)
+    async def event_handler(event):
+        # the event as emitted: Event or dict
+        seen.append(("event", event["uid"], event["value"], event["src"]))
+
+    b.subscribe(kwargs_handler, "!state")
+    await b.emit(Event("!state", uid="a", value=1))
+    await b.emit(topic="!state", uid="b", value=2)
+    assert seen == [
+        ("event", "a", 1, "leaf1"),
+        ("kwargs", "a", 1, "leaf1"),
+        ("event", "b", 2, "leaf1"),
+        ("kwargs", "b", 2, "leaf1"),
+    ]
+
+
+async def test_emit_threadsafe():
+    b = Bus(sync_queue_size=10)
+    seqs = []
+    b.subscribe(lambda seq, **event: seqs.append(seq), "topic")
+
+    def producer(n):
+        for seq in range(n):
+            b.emit_threadsafe(topic="topic", seq=seq)
+        return n
+
+    # producer blocks when the queue is full rather than dropping events
+    assert await b.run_in_thread(producer, 1000) == 1000
+    for _ in range(100):
+        if len(seqs) == 1000:
+            break
+        await asyncio.sleep(0.001)
+    assert seqs == list(range(1000))
+    assert b.dropped == 0
+
+    # other policies drop the overflow
+    b = Bus(sync_queue_size=10, thread_overflow=DROP_OLDEST)
+    b.subscribe(lambda seq, **event: seqs.append(seq), "topic")
+    b.enable_threadsafe()
+    seqs.clear()
+    producer(1000)  # the loop does not drain before producer returns
+    await asyncio.sleep(0.001)
+    assert seqs == list(range(990, 1000))
+    assert b.dropped == 990
+
+
+async def test_subscription_handle():
+    b = Bus()
+    seen = []
+
+    def cb(topic, **event):
+        seen.append(topic)
+
+    sub = b.subscribe(cb, "topic1", "topic2")
+    with b.subscribe(cb, "*"):
+        await b.emit(topic="topic1")
+    await b.emit(topic="topic1")
+    assert seen == ["topic1", "topic1", "topic1"]
+    sub.cancel()
+    sub.cancel()
+    assert not sub.active
+    await b.emit(topic="topic2")
+    assert seen == ["topic1", "topic1", "topic1"]
+
+    # without topics, unsubscribe removes cb from all topics
+    b.subscribe(cb, "topic1", "*")
+    b.subscribe(cb, "!")
+    b.unsubscribe(cb)
+    await b.emit(topic="topic3")
+    assert seen == ["topic1", "topic1", "topic1"]
+    assert b._subscriptions == {}
+    assert b.listeners == {}
+
+    # topics and patterns without subscribers are removed
+    unhandled = []
+    b.subscribe(lambda topic, **event: unhandled.append(topic), "!")
+    with b.subscribe(cb, "x"), b.subscribe(cb, "x*"), b.subscribe(cb, "xy*"):
+        await b.emit(topic="x")
+    await b.emit(topic="x")
+    assert unhandled == ["x"]
+    assert list(b.listeners) == ["!"]
+    assert b._trie == {}
+
+
+async def test_listen_no_subscription():
+    b = Bus()
+    task = asyncio.create_task(b.listen("topic"))
+    await asyncio.sleep(0)
+    assert b.listeners == {}
+    await b.emit(topic="topic", data=1)
+    assert (await task)["data"] == 1
+
+    # cancelled listeners are removed
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(b.listen("topic"), 0.001)
+    assert b._waiters == {}
+
+    # waiters count as handlers: no '!' catch-all
+    unhandled = []
+    b.subscribe(lambda topic, **event: unhandled.append(topic), "!")
+    await b.emit(topic="topic")
+    task = asyncio.create_task(b.listen("topic"))
+    await asyncio.sleep(0)
+    await b.emit(topic="topic")
+    await task
+    await b.emit(topic="topic")
+    assert unhandled == ["topic", "topic"]
+
+
+async def test_priority_lanes():
+    b = Bus(sync_queue_size=100, lanes={"?act": HIGH}, lane_quota=5)
+    seen = []
+    b.subscribe(lambda topic, seq, **event: seen.append((topic, seq)), "!state", "?act")
+    for seq in range(12):
+        b.emit_sync(topic="!state", seq=seq)
+    b.emit_sync(topic="?act", seq=0)
+    await asyncio.sleep(0)
+    # the action overtakes queued telemetry, telemetry still progresses
+    assert seen == [("?act", 0)] + [("!state", seq) for seq in range(5)]
+    b.emit_sync(topic="?act", seq=1)
+    await asyncio.sleep(0)
+    assert seen[6:] == [("?act", 1)] + [("!state", seq) for seq in range(5, 10)]
+    await asyncio.sleep(0)
+    assert seen[12:] == [("!state", 10), ("!state", 11)]
+
+
+async def test_request():
+    b = Bus()
+    b.LEAF_ID = "leaf1"
+
+    async def responder(topic, src, dst, x, rid=None):
+        await asyncio.sleep(0.01 if x == 1 else 0)
+        await b.emit(topic="!square", dst=src, value=x * x, rid=rid)
+
+    b.subscribe(responder, "?square")
+    # concurrent requests on the same topic are answered in reverse order
+    r1, r2 = await asyncio.gather(b.request("?square", x=1), b.request("?square", x=2))
+    assert r1["value"] == 1 and r2["value"] == 4
+    assert r1["rid"] != r2["rid"]
+    with pytest.raises(asyncio.TimeoutError):
+        await b.request("?unknown", timeout=0.01)
+    assert b._requests == {}
+
+    # responses to queries without correlation id carry none
+    b2 = create_bus("leaf2")
+    with b2.stream("!echo") as events:
+        await b2.emit(topic="?echo", src="leaf3", dst="leaf2")
+        assert "rid" not in await events.__anext__()
+
+
+async def test_stream():
+    b = Bus()
+    with b.stream("!state", "?*", maxsize=3) as events:
+        for i in range(5):
+            await b.emit(topic="!state", value=i)
+        await b.emit(topic="?act")
+        await b.emit(topic="!log")
+        assert events.dropped == 3
+        assert [event["value"] for event in [await events.__anext__() for _ in range(2)]] == [3, 4]
+        assert (await events.__anext__())["topic"] == "?act"
+    assert not events.subscription.active
+    assert [event async for event in events] == []
+
+    # BLOCK: emit waits for the consumer
+    events = b.stream("!state", maxsize=1, policy=BLOCK)
+    await b.emit(topic="!state", value=1)
+    task = asyncio.create_task(b.emit(topic="!state", value=2))
+    await asyncio.sleep(0.01)
+    assert not task.done()
+    assert (await events.__anext__())["value"] == 1
+    await task
+    events.close()
+    assert [event["value"] async for event in events] == [2]
+
+    # closing releases blocked emits
+    events = b.stream("!state", maxsize=1, policy=BLOCK)
+    await b.emit(topic="!state", value=1)
+    task = asyncio.create_task(b.emit(topic="!state", value=2))
+    await asyncio.sleep(0)
+    events.close()
+    await asyncio.wait_for(task, 1)
+    assert events.dropped == 1
+
+
+async def test_handler_timeout():
+    b = Bus(handler_timeout=0.01, metrics=True)
+    calls = []
+
+    async def stuck(**event):
+        await asyncio.sleep(1)
+        calls.append("stuck")
+
+    async def patient(**event):
+        await asyncio.sleep(0.02)
+        calls.append("patient")
+
+    def fast(**event):
+        calls.append("fast")
+
+    b.subscribe(stuck, "topic")
+    b.subscribe(patient, "topic", timeout=0.1)
+    b.subscribe(fast, "topic")
+    await asyncio.wait_for(b.emit(topic="topic"), 0.5)
+    assert calls == ["patient", "fast"]
+    failures = b.metrics.report(b)["failures"]  # type: ignore
+    assert list(failures.values()) == [{"errors": 0, "timeouts": 1, "trips": 0}]
+
+
+async def test_circuit_breaker():
+    b = Bus(breaker_threshold=2, breaker_reset=0.05, metrics=True)
+    calls = []
+
+    def flaky(fail, **event):
+        calls.append(fail)
+        if fail:
+            raise ValueError("flaky")
+
+    b.subscribe(flaky, "topic")
+    for _ in range(4):
+        await b.emit(topic="topic", fail=True)
+    # open after 2 consecutive failures
+    assert calls == [True, True]
+    assert b.open_circuits == [flaky]
+    report = b.metrics.report(b)  # type: ignore
+    assert list(report["failures"].values()) == [{"errors": 2, "timeouts": 0, "trips": 1}]
+    assert len(report["open_circuits"]) == 1
+
+    # half open after breaker_reset: a single failure opens it again
+    await asyncio.sleep(0.06)
+    await b.emit(topic="topic", fail=True)
+    await b.emit(topic="topic", fail=False)
+    assert calls == [True, True, True]
+    await asyncio.sleep(0.06)
+    await b.emit(topic="topic", fail=False)
+    await b.emit(topic="topic", fail=True)
+    assert calls == [True, True, True, False, True]
+    assert b.open_circuits == []
+
+    # disabled: failures are not counted
+    b = Bus(breaker_threshold=None)
+    b.subscribe(flaky, "topic")
+    for _ in range(4):
+        await b.emit(topic="topic", fail=True)
+    assert b._failures == {}
+    assert b.open_circuits == []
+
+
+async def test_keyed_workers():
+    b = Bus()
+    log = []
+    active = 0
+    peak = 0
+
+    async def handler(uid, value, **event):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01 if value % 2 else 0.001)
+        log.append((uid, value))
+        active -= 1
+
+    uids = "abcdefghijklmnop"
+    sub = b.subscribe(handler, "!state", workers=4)
+    for value in range(6):
+        for uid in uids:
+            await b.emit(topic="!state", uid=uid, value=value)
+    await asyncio.sleep(0.3)
+    assert len(log) == 6 * len(uids)
+    for uid in uids:
+        # in order per key
+        assert [v for u, v in log if u == uid] == list(range(6))
+    assert peak > 1
+    sub.cancel()
+    assert sub.pool._tasks is None  # type: ignore
+
+    # cancelling releases emits blocked on full worker queues
+    sub = b.subscribe(lambda **event: asyncio.sleep(1), "!state", workers=1)
+    tasks = [asyncio.create_task(b.emit(topic="!state", uid="a", value=i)) for i in range(60)]
+    await asyncio.sleep(0.01)
+    assert not all(task.done() for task in tasks)
+    sub.cancel()
+    await asyncio.wait_for(asyncio.gather(*tasks), 1)
+
+
+def cpu_bound(uid, value, **event):
+    time.sleep(0.05)  # stand-in for computation that holds the GIL or a process
+    return {"topic": "!result", "uid": uid, "value": value * value}
+
+
+on_bus = Bus()
+
+
+@on_bus.on("!state", executor="process")
+def cpu_bound_on(uid, value, **event):
+    return cpu_bound(uid, value, **event)
+
+
+async def test_executor():
+    for executor in ("thread", "process", "on"):
+        if executor == "on":
+            # decorated module level function, pickled by name
+            b = on_bus
+        else:
+            b = Bus()
+            b.subscribe(cpu_bound, "!state", executor=executor)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        response = asyncio.create_task(b.listen("!result"))
+        await asyncio.sleep(0)
+        await b.emit(topic="!state", uid="a", value=3)
+        assert (await asyncio.wait_for(response, 5))["value"] == 9
+        # loop kept running while the handler computed
+        assert ticks > 3, executor
+        task.cancel()
+        b.shutdown_executors()
+
+
+async def test_virtual_clock():
+    clock = VirtualClock(start=1000)
+    b = Bus(clock=clock, breaker_threshold=1, breaker_reset=3600)
+    log = []
+
+    async def sleeper(name, delay):
+        await clock.sleep(delay)
+        log.append((name, clock.time()))
+
+    tasks = [asyncio.create_task(sleeper("b", 7200)), asyncio.create_task(sleeper("a", 60))]
+    await asyncio.sleep(0)
+    await clock.advance(3600)
+    assert log == [("a", 1060)]
+    await clock.advance(3600)
+    assert log == [("a", 1060), ("b", 8200)]
+    assert clock.time() == 8200
+    await asyncio.gather(*tasks)
+
+    # request timeout in virtual time
+    request = asyncio.create_task(b.request("?nobody", timeout=10))
+    await clock.advance(9)
+    assert not request.done()
+    await clock.advance(1)
+    with pytest.raises(asyncio.TimeoutError):
+        await request
+
+    # time budget of a handler returning a future
+    def deferred(**event):
+        future = asyncio.get_event_loop().create_future()
+        asyncio.get_event_loop().call_soon(future.set_result, None)
+        return future
+
+    with b.subscribe(deferred, "topic", timeout=5):
+        await b.emit(topic="topic")
+    assert b.open_circuits == []
+
+    # circuit breaker reset in virtual time
+    def failing(**event):
+        raise ValueError()
+
+    b.subscribe(failing, "topic")
+    await b.emit(topic="topic")
+    assert b.open_circuits == [failing]
+    await clock.advance(3600)
+    await b.emit(topic="topic")
+    assert b.open_circuits == [failing]
+    assert b._open[failing] == clock.time() + 3600
+
+
 # Note: @bus.on handlers cannot be un/resubscribed, causing problems
 #       This test runs correctly on its own, but fails when run with other tests
 async def DISABLE_test_on():
@@ -0,0 +1,40 @@
+import asyncio
+
+from eventbus.ev_bus import Bus
+from plugins.core.recorder import Recorder, read_recording, replay
+
+
+async def test_record_replay(tmp_path):
+    path = str(tmp_path / "rec.jsonl")
+    source = Bus()
+    recorder = Recorder(path, topics=("!state",), max_bytes=400, backups=1, source=source)
+    for i in range(20):
+        await source.emit(topic="!state", uid="leaf1.dev.v", value=i)
+    await source.emit(topic="!log", message="not recorded")
+    recorder.close()
+    await recorder._task
+    assert recorder.recorded == 20
+
+    # rotated, oldest events discarded
+    events = [event for _, event in read_recording(path + ".1", path)]
+    assert 0 < len(events) < 20
+    assert [event["value"] for event in events] == list(range(20 - len(events), 20))
+
+    b = Bus()
+    received = []
+    b.subscribe(lambda value, **event: received.append(value), "!state")
+    report = await replay(path + ".1", path, speed=None, target=b)
+    assert received == [event["value"] for event in events]
+    assert report["events"] == len(events)
+    assert report["topics"] == {"!state": len(events)}
+    assert b.metrics is None
+
+
+async def test_replay_timing(tmp_path):
+    path = str(tmp_path / "rec.jsonl")
+    with open(path, "w") as f:
+        f.write('[100.0, {"topic": "a"}]\n[100.2, {"topic": "b"}]\n')
+    t0 = asyncio.get_event_loop().time()
+    report = await replay(path, speed=10, target=Bus())
+    assert 0.015 < asyncio.get_event_loop().time() - t0 < 0.15
+    assert report["events"] == 2